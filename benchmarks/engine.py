@@ -0,0 +1,196 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from statistics import median
+import tictactoe as ttt
+
+# Micro-benchmarks for the game engine. Every function runs over a fixed
+# corpus of positions and the best of several rounds is reported as calls per
+# second. minimax also reports how many negamax nodes it visits from a cold
+# transposition table.
+#
+#   python -m benchmarks.engine                     # compare with the baseline
+#   python -m benchmarks.engine --update-baseline   # after an intended change
+#
+# Node counts don't depend on the machine, so any increase fails. Raw calls per
+# second move with the machine and whatever else it's doing, so throughput is
+# compared relative to a calibration loop timed right before each benchmark:
+# both slow down together when the machine does.
+
+BASELINE_PATH = Path(__file__).with_name('baseline.json')
+DEFAULT_THRESHOLD = 0.25 # fail when a benchmark gets more than 25% slower
+ROUNDS = 10
+ROUND_TIME = 0.1 # seconds, roughly
+BASELINE_RUNS = 3
+CONFIRM_ATTEMPTS = 2
+
+X, O, E = ttt.X, ttt.O, ttt.EMPTY
+CORPUS = {
+    'opening': [
+        [[E, E, E], [E, E, E], [E, E, E]],
+        [[X, E, E], [E, E, E], [E, E, E]],
+        [[E, E, E], [E, X, E], [E, E, E]],
+        [[E, X, E], [E, E, E], [E, E, E]],
+        [[X, E, E], [E, O, E], [E, E, E]],
+        [[E, E, E], [E, X, E], [E, E, O]],
+    ],
+    'midgame': [
+        [[X, E, E], [E, O, E], [E, E, X]],
+        [[X, O, E], [E, X, E], [E, E, E]],
+        [[E, X, E], [O, X, E], [E, E, E]],
+        [[X, E, O], [E, X, E], [E, E, E]],
+        [[O, E, X], [E, X, E], [E, E, O]],
+        [[X, O, X], [E, O, E], [E, E, E]],
+    ],
+    'endgame': [
+        [[X, O, X], [O, X, E], [O, E, E]],
+        [[X, O, X], [X, O, O], [E, E, E]],
+        [[O, X, X], [X, O, E], [O, E, X]],
+        [[X, X, O], [O, O, X], [X, E, E]],
+        [[X, O, X], [X, O, E], [O, X, E]],
+        [[X, X, X], [O, O, E], [E, E, E]],
+    ],
+}
+
+FUNCTIONS = {
+    'player': lambda board: ttt.player(board),
+    'actions': lambda board: ttt.actions(board),
+    'result': lambda board: [ttt.result(board, action) for action in ttt.actions(board)],
+    'winner': lambda board: ttt.winner(board),
+    'terminal': lambda board: ttt.terminal(board),
+    'minimax': lambda board: cold_minimax(board),
+}
+
+
+def calibration(board):
+    # Plain interpreter work on the board, no engine code.
+    return sum(cell is None for row in board for cell in row)
+
+
+def cold_minimax(board, stats=None):
+    # Measures the search itself, not transposition table hits left over from
+    # earlier calls.
+    ttt.TRANSPOSITION_TABLE.clear()
+    return ttt.minimax(board, stats)
+
+
+def calls_per_second(function, boards):
+    # Finds how many passes over the boards take about ROUND_TIME, then keeps
+    # the best of ROUNDS rounds of that many passes.
+    passes = 1
+    while True:
+        elapsed = time_passes(function, boards, passes)
+        if elapsed >= ROUND_TIME / 10:
+            break
+        passes *= 10
+    passes = max(1, round(passes * ROUND_TIME / elapsed))
+    best = min(time_passes(function, boards, passes) for _ in range(ROUNDS))
+    return passes * len(boards) / best
+
+
+def time_passes(function, boards, passes):
+    start = time.perf_counter()
+    for _ in range(passes):
+        for board in boards:
+            function(board)
+    return time.perf_counter() - start
+
+
+def count_nodes(boards):
+    stats = ttt.SearchStats()
+    for board in boards:
+        cold_minimax(board, stats)
+    return stats.nodes
+
+
+def run(functions=FUNCTIONS, runs=1):
+    # With several runs, every benchmark keeps its median throughput.
+    results = {}
+    for phase, boards in CORPUS.items():
+        for name, function in functions.items():
+            results[f'{name}/{phase}'] = measure(function, boards, runs)
+        if 'minimax' in functions:
+            results[f'minimax/{phase}']['nodes'] = count_nodes(boards)
+    return results
+
+
+def measure(function, boards, runs=1):
+    # {'ops_per_sec': calls per second, 'relative': the same divided by the
+    # calibration loop's calls per second}
+    ops, relative = [], []
+    for _ in range(runs):
+        calibration_ops = calls_per_second(calibration, boards)
+        ops.append(calls_per_second(function, boards))
+        relative.append(ops[-1] / calibration_ops)
+    return {'ops_per_sec': round(median(ops), 1), 'relative': round(median(relative), 5)}
+
+
+def confirm(results, regressions, baseline, threshold, attempts=CONFIRM_ATTEMPTS):
+    # Timings on a busy machine jump around, so a benchmark only counts as
+    # slower if it stays slower when measured again.
+    for _ in range(attempts):
+        if not regressions:
+            break
+        for name in {name for name, _ in regressions}:
+            function_name, phase = name.split('/')
+            result = measure(FUNCTIONS[function_name], CORPUS[phase])
+            if result['relative'] > results[name]['relative']:
+                results[name].update(result)
+        regressions = compare(results, baseline, threshold)
+    return regressions
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    # Returns (benchmark, message) for every regression: more nodes searched
+    # for the same positions, or throughput relative to the calibration loop
+    # more than threshold below the baseline.
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if not expected:
+            continue
+        if 'nodes' in expected and result.get('nodes', 0) > expected['nodes']:
+            regressions.append((name, f"{result['nodes']} nodes, baseline {expected['nodes']}"))
+        if 'relative' in expected and result['relative'] < expected['relative'] * (1 - threshold):
+            regressions.append(
+                (name, f"{result['relative']:.4f}x the calibration loop, baseline {expected['relative']:.4f}x")
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the game engine.')
+    parser.add_argument('--update-baseline', action='store_true', help=f'save the results to {BASELINE_PATH.name}')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed slowdown as a fraction of the baseline, default %(default)s')
+    parser.add_argument('--baseline', type=Path, default=BASELINE_PATH, help='baseline file to compare with')
+    args = parser.parse_args()
+
+    # A baseline from one lucky run would make every later run look slow.
+    results = run(runs=BASELINE_RUNS if args.update_baseline else 1)
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    for name, result in results.items():
+        line = f"{name:<20} {result['ops_per_sec']:>12.0f} ops/sec"
+        if 'nodes' in result:
+            line += f" {result['nodes']:>8} nodes"
+        if 'relative' in baseline.get(name, {}):
+            change = result['relative'] / baseline[name]['relative'] - 1
+            line += f"   {change:+.1%} vs baseline"
+        print(line)
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(results, indent=4) + '\n')
+        print(f'Saved to {args.baseline}')
+        return
+
+    regressions = confirm(results, compare(results, baseline, args.threshold), baseline, args.threshold)
+    for name, message in regressions:
+        print(f'REGRESSION {name}: {message}')
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
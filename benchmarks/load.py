@@ -0,0 +1,182 @@
+import argparse
+import asyncio
+import os
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+import httpx
+from sqlalchemy import create_engine
+import migrations
+import models
+
+# Load test for the whole API. Starts the app under uvicorn on a temporary
+# SQLite database and lets simulated players go through the real flow: create
+# a game, make a move and ask the AI for its reply until the game ends, reset
+# it and play again. Reports throughput and latency percentiles per route.
+#
+#   python -m benchmarks.load --players 2000 --concurrency 200 --workers 2
+#
+# Everything runs on localhost. Environment variables like GAME_CACHE_SIZE are
+# passed on to the server.
+
+ROOT = Path(__file__).resolve().parent.parent
+PERCENTILES = (50, 95, 99)
+STARTUP_TIMEOUT = 30 # seconds
+
+
+class Stats:
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def request(self, client, route, method, url, **kwargs):
+        # Returns None if the request failed without a response, which counts
+        # as an error for the route like a 4xx or 5xx does.
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.TransportError:
+            response = None
+        self.latencies[route].append(time.perf_counter() - start)
+        if response is None or response.status_code >= 400:
+            self.errors[route] += 1
+        return response
+
+    def report(self, elapsed):
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        print(f'{total} requests in {elapsed:.1f} s, {total / elapsed:.0f} requests/s')
+        print(f"{'route':<28}{'count':>8}{'errors':>8}{'req/s':>9}" + ''.join(f'{f"p{p} ms":>10}' for p in PERCENTILES))
+        for route, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            line = f'{route:<28}{len(latencies):>8}{self.errors[route]:>8}{len(latencies) / elapsed:>9.0f}'
+            line += ''.join(f'{percentile(latencies, p) * 1000:>10.1f}' for p in PERCENTILES)
+            print(line)
+
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile.
+    index = max(0, -(-len(sorted_values) * p // 100) - 1)
+    return sorted_values[index]
+
+
+async def play(client, stats, rounds, rng):
+    response = await stats.request(client, 'POST /games/', 'POST', '/games/', json={})
+    if response is None or response.status_code >= 400:
+        return
+    game = response.json()
+    game_id = game['id']
+    for round_number in range(rounds):
+        if round_number:
+            response = await stats.request(client, 'PUT /games/{id}', 'PUT', f'/games/{game_id}', json={})
+            if response is None or response.status_code >= 400:
+                return
+            game = response.json()
+        while not game['winner']:
+            if game['current_player'] == game['ai_symbol']:
+                response = await stats.request(client, 'PATCH /games/{id} (AI)', 'PATCH', f'/games/{game_id}')
+            else:
+                free_cells = [
+                    (x, y) for x, row in enumerate(game['state']) for y, cell in enumerate(row) if cell is None
+                ]
+                x, y = rng.choice(free_cells)
+                response = await stats.request(
+                    client, 'PATCH /games/{id} (human)', 'PATCH', f'/games/{game_id}', json={'x': x, 'y': y}
+                )
+            if response is None or response.status_code >= 400:
+                return
+            game = response.json()
+
+
+async def run_players(base_url, players, concurrency, rounds, seed):
+    stats = Stats()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def player(number):
+            async with semaphore:
+                await play(client, stats, rounds, random.Random(seed + number))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(player(number) for number in range(players)))
+        elapsed = time.perf_counter() - start
+    return stats, elapsed
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def create_database(database_path):
+    # Done once here, not by the workers: each worker creates the tables on
+    # startup, and on a fresh file they race and all but one fail.
+    engine = create_engine(f'sqlite:///{database_path}')
+    with engine.begin() as connection:
+        models.Base.metadata.create_all(connection)
+        migrations.run_migrations(connection)
+    engine.dispose()
+
+
+def start_server(port, workers, database_path):
+    env = dict(os.environ, DATABASE_URL=f'sqlite+aiosqlite:///{database_path}')
+    # Every worker has to accept the others' cursors.
+    env.setdefault('CURSOR_SECRET', secrets.token_hex(32))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--log-level', 'warning'],
+        cwd=ROOT, env=env,
+    )
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('The server exited during startup')
+        try:
+            if httpx.get(f'http://127.0.0.1:{port}/games/', params={'limit': 1}).status_code == 200:
+                return server
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"The server didn't start in {STARTUP_TIMEOUT} seconds")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the API with simulated players.')
+    parser.add_argument('--players', type=int, default=1000, help='number of simulated players, default %(default)s')
+    parser.add_argument('--concurrency', type=int, default=100,
+                        help='players playing at the same time, default %(default)s')
+    parser.add_argument('--rounds', type=int, default=2, help='games each player plays, default %(default)s')
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn worker processes, default %(default)s')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the players\' moves')
+    parser.add_argument('--url', help='test an already running server instead of starting one')
+    args = parser.parse_args()
+
+    server = None
+    with tempfile.TemporaryDirectory() as directory:
+        base_url = args.url
+        if not base_url:
+            port = free_port()
+            database_path = Path(directory) / 'load.db'
+            create_database(database_path)
+            server = start_server(port, args.workers, database_path)
+            base_url = f'http://127.0.0.1:{port}'
+        try:
+            stats, elapsed = asyncio.run(run_players(base_url, args.players, args.concurrency, args.rounds, args.seed))
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+    stats.report(elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.exc import IntegrityError
+import models
+from config import *
+
+# Write-behind cache for active games. Moves are applied to the cached copy and
+# written to the database in batches, so a turn doesn't wait for a commit.
+# Pending changes are flushed every GAME_CACHE_FLUSH_INTERVAL seconds, when a
+# game ends, when it's evicted and when the app shuts down. The cache owns the
+# games it holds, so it's only safe with a single worker process (or sticky
+# routing by game ID).
+
+logger = logging.getLogger(__name__)
+
+GAMES = models.Game.__table__
+# Only updates the row if it still holds the version the cache last saw, so a
+# newer write from somewhere else is never overwritten.
+FLUSH_STATEMENT = update(GAMES).where(
+    GAMES.c.id == bindparam('game_id'), GAMES.c.version == bindparam('old_version')
+).values(
+    state=bindparam('new_state', type_=models.BoardState),
+    ai_symbol=bindparam('new_ai_symbol'),
+    winner=bindparam('new_winner'),
+    current_player=bindparam('new_current_player'),
+    version=bindparam('new_version'),
+    round=bindparam('new_round'),
+    board_size=bindparam('new_board_size'),
+    win_length=bindparam('new_win_length'),
+    engine=bindparam('new_engine'),
+    difficulty=bindparam('new_difficulty'),
+)
+MOVES = models.Move.__table__
+
+
+class GameConflict(Exception):
+    pass
+
+
+def move_row(move):
+    return {
+        'game_id': move.game_id,
+        'round': move.round,
+        'ply': move.ply,
+        'symbol': move.symbol,
+        'x': move.x,
+        'y': move.y,
+        'created_at': move.created_at,
+    }
+
+
+def copy_game(game):
+    return models.Game(
+        id=game.id,
+        state=[row[:] for row in game.state],
+        ai_symbol=game.ai_symbol,
+        winner=game.winner,
+        current_player=game.current_player,
+        version=game.version,
+        round=game.round,
+        board_size=game.board_size,
+        win_length=game.win_length,
+        engine=game.engine,
+        difficulty=game.difficulty,
+    )
+
+
+class CachedGame:
+
+    def __init__(self, game, dirty, moves=None, stored_version=None):
+        self.game = game
+        self.dirty = dirty
+        # Moves not written yet.
+        self.moves = moves if moves is not None else []
+        # Version of the game in the database.
+        self.stored_version = game.version if stored_version is None else stored_version
+        self.last_used = time.monotonic()
+
+
+class GameCache:
+
+    def __init__(self, session_factory, max_size=GAME_CACHE_SIZE, ttl=GAME_CACHE_TTL,
+                 flush_interval=GAME_CACHE_FLUSH_INTERVAL):
+        self.session_factory = session_factory
+        self.max_size = max_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.entries = OrderedDict()
+        # Dirty entries pushed out of entries whose write hasn't committed
+        # yet. Reads still see them, otherwise they'd load the old row.
+        self.evicted = {}
+        self.flush_lock = asyncio.Lock()
+        self.flush_task = None
+
+    async def get(self, db, game_id):
+        entry = self.entries.get(game_id)
+        if entry:
+            entry.last_used = time.monotonic()
+            self.entries.move_to_end(game_id)
+        else:
+            entry = self.evicted.get(game_id)
+        if entry:
+            return copy_game(entry.game)
+
+        game = await db.scalar(select(models.Game).where(models.Game.id == game_id))
+        if not game:
+            return None
+        # Another request may have cached the game while we were querying.
+        if game_id not in self.entries and game_id not in self.evicted:
+            await self.store(copy_game(game))
+        return copy_game(game)
+
+    async def put(self, game, moves=()):
+        entry = self.entries.get(game.id) or self.evicted.get(game.id)
+        if entry and entry.game.version != game.version:
+            raise GameConflict(game.id)
+        # Bump the caller's copy too, it may keep using it for the next move.
+        game.version += 1
+        if entry:
+            # Updated in place, so a write of this entry that is still running
+            # only clears what it actually wrote.
+            entry.game = copy_game(game)
+            entry.dirty = True
+            entry.moves.extend(moves)
+            self.evicted.pop(game.id, None)
+        else:
+            # Evicted and written since the caller loaded it.
+            entry = CachedGame(copy_game(game), True, list(moves), stored_version=game.version - 1)
+        await self.keep(entry)
+        if game.winner and game.id in await self.flush([game.id]):
+            raise GameConflict(game.id)
+
+    async def store(self, game):
+        # Caches a game as it is in the database.
+        await self.keep(CachedGame(game, dirty=False))
+
+    async def keep(self, entry):
+        self.entries[entry.game.id] = entry
+        self.entries.move_to_end(entry.game.id)
+        entry.last_used = time.monotonic()
+        evicted = []
+        while len(self.entries) > self.max_size:
+            game_id, evicted_entry = self.entries.popitem(last=False)
+            if evicted_entry.dirty:
+                self.evicted[game_id] = evicted_entry
+                evicted.append(evicted_entry)
+        await self.write(evicted)
+
+    def drop(self, entry):
+        for entries in (self.entries, self.evicted):
+            if entries.get(entry.game.id) is entry:
+                del entries[entry.game.id]
+
+    def discard_all(self):
+        self.entries.clear()
+        self.evicted.clear()
+
+    async def flush(self, game_ids=None):
+        # Returns the IDs of games that couldn't be written, because they were
+        # changed in the database since they were cached or their moves clash
+        # with logged ones.
+        if game_ids is None:
+            game_ids = list(self.entries) + list(self.evicted)
+        entries = [self.entries.get(game_id) or self.evicted.get(game_id) for game_id in game_ids]
+        return await self.write([entry for entry in entries if entry and entry.dirty])
+
+    async def write(self, entries):
+        if not entries:
+            return set()
+        async with self.flush_lock:
+            # The entries may change while we wait for the database, so keep
+            # what is being written: the game copy and the number of moves.
+            pending = [(entry, entry.game, len(entry.moves)) for entry in entries if entry.dirty]
+            failed = []
+            async with self.session_factory() as db:
+                # Every game gets its own savepoint, so one that can't be
+                # written doesn't hold back the others.
+                for entry, game, count in pending:
+                    try:
+                        async with db.begin_nested():
+                            result = await db.execute(FLUSH_STATEMENT, {
+                                'game_id': game.id,
+                                'old_version': entry.stored_version,
+                                'new_state': game.state,
+                                'new_ai_symbol': game.ai_symbol,
+                                'new_winner': game.winner,
+                                'new_current_player': game.current_player,
+                                'new_version': game.version,
+                                'new_round': game.round,
+                                'new_board_size': game.board_size,
+                                'new_win_length': game.win_length,
+                                'new_engine': game.engine,
+                                'new_difficulty': game.difficulty,
+                            })
+                            if result.rowcount == 0:
+                                raise GameConflict(game.id)
+                            if count:
+                                await db.execute(insert(MOVES), [move_row(move) for move in entry.moves[:count]])
+                    except (GameConflict, IntegrityError) as error:
+                        failed.append((entry, error))
+                await db.commit()
+            failed_entries = [entry for entry, _ in failed]
+            for entry, game, count in pending:
+                if entry in failed_entries:
+                    continue
+                entry.stored_version = game.version
+                del entry.moves[:count]
+                if entry.game.version == game.version:
+                    entry.dirty = False
+                    if self.evicted.get(game.id) is entry:
+                        del self.evicted[game.id]
+            # Either the database has a newer version of the game or its moves
+            # clash with ones already logged. Retrying would fail the same way,
+            # so the entry is dropped and the next read loads the stored game.
+            for entry, error in failed:
+                logger.warning("Couldn't write game %s (%r), dropping its cached changes", entry.game.id, error)
+                self.drop(entry)
+            return {entry.game.id for entry in failed_entries}
+
+    async def expire(self):
+        now = time.monotonic()
+        expired = [game_id for game_id, entry in self.entries.items() if now - entry.last_used > self.ttl]
+        await self.flush(expired)
+        for game_id in expired:
+            entry = self.entries.get(game_id)
+            if entry and not entry.dirty and now - entry.last_used > self.ttl:
+                del self.entries[game_id]
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.expire()
+                await self.flush()
+            except Exception:
+                logger.exception('Flushing cached games failed, will retry')
+
+    def start(self):
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.run())
+
+    async def close(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        await self.flush()
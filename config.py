@@ -1,4 +1,56 @@
+import os
+import secrets
+
 DEFAULT_FIRST_PLAYER_SYMBOL = 'X'
 DEFAULT_AI_SYMBOL = 'O'
 GAME_ID_LENGTH = 10
-DATABASE_URL = "sqlite:///./games.db" # manually change it also in alembic.ini
\ No newline at end of file
+DEFAULT_BOARD_SIZE = 3
+MIN_BOARD_SIZE = 3
+MAX_BOARD_SIZE = 7
+MIN_WIN_LENGTH = 3
+WS_CLOSE_GAME_NOT_FOUND = 4404
+DATABASE_URL = os.environ.get('DATABASE_URL', "sqlite+aiosqlite:///./games.db") # manually change it also in alembic.ini
+DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 5))
+DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW', 10))
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)) # milliseconds
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)) # bytes
+GAME_CACHE_SIZE = int(os.environ.get('GAME_CACHE_SIZE', 0)) # games kept by the write-behind cache, 0 disables it
+GAME_CACHE_TTL = float(os.environ.get('GAME_CACHE_TTL', 60)) # seconds since the last move
+GAME_CACHE_FLUSH_INTERVAL = float(os.environ.get('GAME_CACHE_FLUSH_INTERVAL', 1)) # seconds
+TRANSPOSITION_TABLE_SIZE = 4096
+ANALYSIS_CACHE_SIZE = 8192 # enough for every reachable position
+AI_MOVES_MAX_BATCH_SIZE = 10000
+AI_WORKERS = 2 # processes used for AI searches, 0 runs them in the request instead
+AI_SEARCH_TIMEOUT = 5 # seconds
+AI_MOVE_TIME_BUDGET = 1 # seconds a search on a board bigger than 3x3 may take
+DEFAULT_ENGINE = 'minimax'
+MCTS_ITERATIONS = 20000 # rollouts per tree, each AI worker grows its own tree
+MCTS_EXPLORATION = 1.4 # UCT exploration constant
+MCTS_TREE_REUSE = True # keep each game's trees between moves
+MCTS_TREE_CACHE_SIZE = 256 # trees kept per process
+DEFAULT_DIFFICULTY = 'hard'
+# difficulty: (plies the minimax engine looks ahead, MCTS playouts per tree,
+# chance of a random move). None means a full search.
+DIFFICULTY_LEVELS = {
+    'easy': (1, 200, 0.3),
+    'medium': (2, 2000, 0.1),
+    'hard': (None, MCTS_ITERATIONS, 0),
+}
+GAMES_PAGE_SIZE = 100
+GAMES_MAX_PAGE_SIZE = 1000
+GAMES_STREAM_BATCH_SIZE = 500
+EVENTS_QUEUE_SIZE = 16 # updates buffered per spectator
+EVENTS_KEEPALIVE_INTERVAL = 15 # seconds
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10) # seconds
+METRICS_NODE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+# Lets requests with the X-Debug-Profile header profile themselves, keep it off in production.
+DEBUG_PROFILING = os.environ.get('DEBUG_PROFILING') == '1'
+DEBUG_PROFILE_HEADER = 'X-Debug-Profile'
+DEBUG_PROFILE_LINES = 30 # functions listed in the profile summary
+# 'module:function' set as tictactoe.trace_hook in the API and in every AI
+# worker, so it sees every position searched.
+SEARCH_TRACE_HOOK = os.environ.get('SEARCH_TRACE_HOOK')
+# Set it to the same value on every worker, otherwise cursors only work on the
+# process that issued them and stop working after a restart. The app warns at
+# startup when it's missing and there's more than one worker.
+CURSOR_SECRET = os.environ.get('CURSOR_SECRET', secrets.token_hex(32)).encode()
@@ -1,19 +1,46 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import declarative_base
 from config import * 
 SQLALCHEMY_DATABASE_URL = DATABASE_URL
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, 
-    connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def engine_options(url):
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # In-memory SQLite uses a single shared connection, there's no pool to size.
+        return {}
+    return {
+        'pool_size': DATABASE_POOL_SIZE,
+        'max_overflow': DATABASE_MAX_OVERFLOW,
+        'pool_pre_ping': url.get_backend_name() != 'sqlite',
+    }
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers run while a move is being written, and synchronous=NORMAL
+    # is safe with WAL while skipping an fsync on every commit.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+
+def build_engine(url, **kwargs):
+    engine = create_async_engine(url, **engine_options(url), **kwargs)
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine.sync_engine, 'connect', set_sqlite_pragmas)
+    return engine
+
+
+engine = build_engine(SQLALCHEMY_DATABASE_URL)
+SessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
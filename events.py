@@ -0,0 +1,36 @@
+import asyncio
+from collections import defaultdict
+from config import *
+
+# In-process fan-out of game updates to spectators. Every change is serialized
+# once by the publisher and handed to each subscriber's queue, so watchers
+# never touch the database. Subscribers only see changes made by the same
+# process.
+
+
+class BroadcastHub:
+
+    def __init__(self, queue_size=EVENTS_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers = defaultdict(set)
+
+    def subscribe(self, game_id):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers[game_id].add(queue)
+        return queue
+
+    def unsubscribe(self, game_id, queue):
+        queues = self.subscribers.get(game_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self.subscribers[game_id]
+
+    def publish(self, game_id, message):
+        for queue in self.subscribers.get(game_id, ()):
+            # A spectator that can't keep up skips to the newest states instead
+            # of slowing down the players.
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(message)
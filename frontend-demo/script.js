@@ -5,6 +5,9 @@ let gameId = null
 let gameState = null
 let currentPlayer = null
 let winner = null
+let socket = null
+let gameUpdates = []
+let gameUpdateWaiter = null
 
 document.addEventListener('DOMContentLoaded', async () => {
     grid = document.querySelector('.tic-tac-toe');
@@ -18,6 +21,7 @@ document.addEventListener('DOMContentLoaded', async () => {
     startGameButton.onclick = async () => {
         startGameButton.innerHTML = 'Restart game';
         await initializeGame();
+        await connectToGame();
         updateGridState();
         game();
         startGameButton.classList.add('hidden');
@@ -27,6 +31,7 @@ document.addEventListener('DOMContentLoaded', async () => {
     restartGameButton.onclick = async () => {
         grid.removeEventListener('click', gridClickEventListener)
         await restartGame();
+        await connectToGame();
         updateGridState();
         game();
     };
@@ -37,7 +42,8 @@ async function game() {
     do {
         if (currentPlayer == aiSymbol) {
             markAllCellsDisabled()
-            await makeAIMove()
+            // The server pushes the AI's move on its own.
+            await waitForGameUpdate()
             
             await sleep(500)
             updateGridState()
@@ -45,6 +51,7 @@ async function game() {
         else {
             markAllCellsEnabled()
             let humanMove = await waitForPlayerMove()
+            markAllCellsDisabled()
             await makeHumanMove(humanMove)
             updateGridState();
         }
@@ -104,34 +111,35 @@ async function restartGame() {
     return gameId
 }
 
-async function makeAIMove() {
-    const response = await fetch(`http://127.0.0.1:8000/games/${gameId}`, {method: 'PATCH'})
-    let data = await response.json()
-    if (response.ok) {
-        gameState = data.state
-        currentPlayer = data.current_player
-        winner = data.winner
+// Moves go through a WebSocket, the server answers every move with the new
+// game state and then pushes the AI's reply.
+function connectToGame() {
+    if (socket) {
+        socket.close()
     }
-    else {
-        sendMessage(data.detail)
+    gameUpdates = []
+    gameUpdateWaiter = null
+    socket = new WebSocket(`ws://127.0.0.1:8000/games/${gameId}/ws`)
+    socket.onmessage = event => {
+        let data = JSON.parse(event.data)
+        if (gameUpdateWaiter) {
+            let resolve = gameUpdateWaiter
+            gameUpdateWaiter = null
+            resolve(data)
+        }
+        else {
+            gameUpdates.push(data)
+        }
     }
-    return gameId
+    // The first message is the current state of the game.
+    return waitForGameUpdate()
 }
 
-async function makeHumanMove(humanMove) {
-    const response = await fetch(`http://127.0.0.1:8000/games/${gameId}`, {
-        method: 'PATCH',
-        headers: {
-            "Content-Type": "application/json",
-        },
-        body: JSON.stringify({
-            'x': parseInt(humanMove[0]),
-            'y': parseInt(humanMove[2])
-        })
-    })
-
-    data = await response.json()
-    if (response.ok) {
+async function waitForGameUpdate() {
+    let data = gameUpdates.length
+        ? gameUpdates.shift()
+        : await new Promise(resolve => { gameUpdateWaiter = resolve })
+    if (data.state) {
         gameState = data.state
         currentPlayer = data.current_player
         winner = data.winner
@@ -139,8 +147,15 @@ async function makeHumanMove(humanMove) {
     else {
         sendMessage(data.detail)
     }
-    
-    return gameId
+    return data
+}
+
+async function makeHumanMove(humanMove) {
+    socket.send(JSON.stringify({
+        'x': parseInt(humanMove[0]),
+        'y': parseInt(humanMove[2])
+    }))
+    return waitForGameUpdate()
 }
 
 
@@ -1,125 +1,460 @@
-from fastapi import Depends, FastAPI, HTTPException, Path, Body
-from sqlalchemy.orm import Session
+from fastapi import Depends, FastAPI, Header, HTTPException, Path, Body, Query, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, insert, delete
+from sqlalchemy.orm.exc import StaleDataError
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+from contextlib import asynccontextmanager, nullcontext
+import asyncio
+import random
 import tictactoe as ttt
+import workers
+import mcts
+import pagination
+import migrations
+import cache
+import events
+import metrics
+import profiling
+import singleflight
 import models as models, schemas as schemas
 from typing import Annotated
-from database import engine, get_db
+from database import engine, get_db, SessionLocal
 from fastapi.middleware.cors import CORSMiddleware
 from config import *
 
-models.Base.metadata.create_all(bind=engine)
-app = FastAPI()
+SOLVED_GAME = ttt.solve_game()
+game_cache = cache.GameCache(SessionLocal) if GAME_CACHE_SIZE else None
+hub = events.BroadcastHub()
+search_flights = singleflight.SingleFlight(on_shared=metrics.AI_SEARCHES_COALESCED.inc)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    pagination.check_cursor_secret()
+    async with engine.begin() as connection:
+        await connection.run_sync(models.Base.metadata.create_all)
+        await connection.run_sync(migrations.run_migrations)
+    await run_in_threadpool(workers.start_executor)
+    if game_cache:
+        game_cache.start()
+    yield
+    if game_cache:
+        await game_cache.close()
+    workers.shutdown_executor()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=['*'],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.instrument_engine(engine.sync_engine)
 
 
 @app.get('/games/', response_model=list[schemas.Game])
-def get_games_view(db: Session = Depends(get_db)):
-    games = db.query(models.Game).all()
+async def get_games_view(
+        response: Response,
+        limit: Annotated[int, Query(ge=1, le=GAMES_MAX_PAGE_SIZE)] = GAMES_PAGE_SIZE,
+        cursor: str | None = None,
+        winner: schemas.Result | None = None,
+        ai_symbol: schemas.Symbol | None = None,
+        stream: bool = False,
+        db: AsyncSession = Depends(get_db)
+    ):
+    if game_cache:
+        await game_cache.flush()
+
+    query = select(models.Game).order_by(models.Game.id)
+    if cursor:
+        query = query.where(models.Game.id > decode_cursor_or_400(cursor))
+    if winner:
+        query = query.where(models.Game.winner == winner.value)
+    if ai_symbol:
+        query = query.where(models.Game.ai_symbol == ai_symbol.value)
+
+    if stream:
+        return StreamingResponse(stream_games(db, query), media_type='application/x-ndjson')
+
+    games = (await db.scalars(query.limit(limit + 1))).all()
+    if len(games) > limit:
+        games = games[:limit]
+        response.headers['X-Next-Cursor'] = pagination.encode_cursor(games[-1].id)
     return games
 
 
 @app.get('/games/{game_id}', response_model=schemas.Game)
-def get_game_view(
+async def get_game_view(
         game_id: Annotated[str, Path(min_length=GAME_ID_LENGTH, max_length=GAME_ID_LENGTH)], 
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
     ):
-    game = get_game_or_404(db, game_id)
+    game = await get_game_or_404(db, game_id)
     return game
 
 
 @app.post('/games/', response_model=schemas.GameWithId)
-def create_game_view(
+async def create_game_view(
         game: schemas.CreateGame,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
     ):
-    new_game = models.Game(ai_symbol=game.ai_symbol)
-    save_game(new_game, db)
-    db.refresh(new_game)
+    board_size, win_length = get_board_parameters(game)
+    new_game = await db.scalar(
+        insert(models.Game).returning(models.Game),
+        [{
+            'ai_symbol': game.ai_symbol,
+            'state': ttt.initial_state(board_size),
+            'board_size': board_size,
+            'win_length': win_length,
+            'engine': game.engine or DEFAULT_ENGINE,
+            'difficulty': game.difficulty or DEFAULT_DIFFICULTY,
+        }]
+    )
+    await db.commit()
+    if game_cache:
+        await game_cache.store(cache.copy_game(new_game))
     return new_game
 
 
 @app.patch('/games/{game_id}', response_model=schemas.Game)
-def game_action_view(
+async def game_action_view(
         game_id: Annotated[str, Path(min_length=GAME_ID_LENGTH, max_length=GAME_ID_LENGTH)], 
         action: schemas.Action | None = None, 
-        db: Session = Depends(get_db)
+        ai_reply: bool = False,
+        debug_profile: Annotated[str | None, Header(alias=DEBUG_PROFILE_HEADER)] = None,
+        db: AsyncSession = Depends(get_db)
     ):
 
-    game = get_game_or_404(db, game_id)
-    raise_400_if_game_is_over(game)
-    
-    player = ttt.player(game.state)
-    if player == game.ai_symbol:
-        action = get_ai_action(game)
-    elif action:
-        action = (action.x, action.y)
-    else:
-        raise HTTPException(status_code=400, detail="You must provide your move's coordinates (x, y)!")
-    
-    raise_400_if_action_is_invalid(action, game)
+    profile = profiling.RequestProfile() if DEBUG_PROFILING and debug_profile else None
+    async with profile or nullcontext():
+        game = await get_game_or_404(db, game_id)
+        moves = [await make_move(game, action, profile)]
 
-    game.state = ttt.result(game.state, action) 
-    game.current_player = ttt.player(game.state)
-    game.winner = get_game_result(game)
-    save_game(game, db)
+        if ai_reply and is_ai_turn(game):
+            moves.append(await make_move(game, profile=profile))
+
+        await save_game(game, db, moves)
+
+    if profile:
+        game_data = schemas.Game.model_validate(game, from_attributes=True).model_dump(mode='json')
+        return JSONResponse({**game_data, 'debug': profile.report()})
     return game
 
+@app.websocket('/games/{game_id}/ws')
+async def game_websocket(
+        websocket: WebSocket,
+        game_id: Annotated[str, Path(min_length=GAME_ID_LENGTH, max_length=GAME_ID_LENGTH)], 
+        db: AsyncSession = Depends(get_db)
+    ):
+    # The game is loaded once and kept for the whole connection. Every message
+    # is a move ({"x": ..., "y": ...}, or {} for the AI), the server answers
+    # with the game after it and then pushes the AI's reply on its own.
+    # Like the events stream, the session is closed after every load, so an
+    # idle connection doesn't keep a database connection checked out. Saving
+    # commits, which gives the connection back as well.
+    await websocket.accept()
+    try:
+        game = await get_game_or_404(db, game_id)
+    except HTTPException as error:
+        # Before closing the socket, the client may not wait for anything after.
+        await db.close()
+        await websocket.close(code=WS_CLOSE_GAME_NOT_FOUND, reason=error.detail)
+        return
+    await db.close()
+
+    async def play(action=None):
+        nonlocal game
+        try:
+            await save_game(game, db, [await make_move(game, action)])
+            await send_game(websocket, game)
+            if is_ai_turn(game):
+                await save_game(game, db, [await make_move(game)])
+                await send_game(websocket, game)
+        except HTTPException as error:
+            await websocket.send_json({'detail': error.detail})
+            if error.status_code == 409:
+                game = await get_game_or_404(db, game_id)
+                await db.close()
+                await send_game(websocket, game)
+
+    await send_game(websocket, game)
+    try:
+        if is_ai_turn(game):
+            await play()
+        while True:
+            try:
+                # Frames that aren't JSON text are invalid moves too.
+                data = await websocket.receive_json()
+                action = schemas.Action.model_validate(data) if data else None
+            except (ValueError, KeyError, TypeError, ValidationError):
+                await websocket.send_json({'detail': "Invalid move!"})
+                continue
+            await play(action)
+    except WebSocketDisconnect:
+        pass
+
 @app.put('/games/{game_id}', response_model=schemas.GameWithId)
-def game_reset_view(
+async def game_reset_view(
         game_id: Annotated[str, Path(min_length=GAME_ID_LENGTH, max_length=GAME_ID_LENGTH)], 
         input_game: schemas.CreateGame,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
     ):
 
-    game = get_game_or_404(db, game_id)
-    game.state = ttt.initial_state()
+    game = await get_game_or_404(db, game_id)
+    # Still a full rewrite of the game: the settings can change, and the state
+    # is the snapshot every read uses. The round bump is what keeps the moves
+    # of earlier rounds apart in the log.
+    game.board_size, game.win_length = get_board_parameters(input_game, game)
+    game.round += 1
+    game.state = ttt.initial_state(game.board_size)
     game.winner = None
     game.current_player = DEFAULT_FIRST_PLAYER_SYMBOL
     game.ai_symbol = input_game.ai_symbol
-    save_game(game, db)
+    game.engine = input_game.engine or game.engine
+    game.difficulty = input_game.difficulty or game.difficulty
+    await save_game(game, db)
     return game
     
+@app.get('/games/{game_id}/events')
+async def game_events_view(
+        game_id: Annotated[str, Path(min_length=GAME_ID_LENGTH, max_length=GAME_ID_LENGTH)], 
+        db: AsyncSession = Depends(get_db)
+    ):
+    game = await get_game_or_404(db, game_id)
+    # Spectators can stay for a long time, don't keep a connection checked out.
+    await db.close()
+    return StreamingResponse(
+        stream_game_events(game_id, serialize_game(game)),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.get('/games/{game_id}/moves', response_model=list[schemas.Move])
+async def get_game_moves_view(
+        game_id: Annotated[str, Path(min_length=GAME_ID_LENGTH, max_length=GAME_ID_LENGTH)], 
+        db: AsyncSession = Depends(get_db)
+    ):
+    game = await get_game_or_404(db, game_id)
+    if game_cache:
+        await game_cache.flush([game_id])
+    moves = await db.scalars(
+        select(models.Move)
+        .where(models.Move.game_id==game_id, models.Move.round==game.round)
+        .order_by(models.Move.ply)
+    )
+    return moves.all()
+
+@app.post('/ai/moves', response_model=schemas.AIMovesResponse)
+async def ai_moves_view(request: schemas.AIMovesRequest):
+    # Identical boards are looked up once, every lookup is a read from the
+    # solved game, so the whole batch needs no search.
+    keys = [ttt.board_key(board) for board in request.boards]
+    moves = {}
+    for i, key in enumerate(keys):
+        if key in moves:
+            continue
+        solved = SOLVED_GAME.get(key)
+        if not solved:
+            raise HTTPException(status_code=400, detail=f"Board {i} isn't a position that can happen in a game.")
+        optimal_actions = solved[1]
+        moves[key] = schemas.Action(x=optimal_actions[0][0], y=optimal_actions[0][1]) if optimal_actions else None
+    return {'moves': [moves[key] for key in keys]}
+
+@app.post('/analyze', response_model=schemas.Analysis)
+async def analyze_view(request: schemas.AnalyzeRequest):
+    if ttt.board_key(request.state) not in SOLVED_GAME:
+        raise HTTPException(status_code=400, detail="This board isn't a position that can happen in a game.")
+    return {
+        'player': ttt.player(request.state),
+        'moves': [
+            {'x': x, 'y': y, 'value': value, 'plies': plies}
+            for (x, y), value, plies in ttt.analyze(request.state)
+        ],
+    }
+
+@app.get('/metrics', response_class=PlainTextResponse)
+async def metrics_view():
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
 @app.delete('/games/', status_code=204)
-def delete_games_view(db: Session = Depends(get_db)):
-    delete_all_games(db)
+async def delete_games_view(db: AsyncSession = Depends(get_db)):
+    await delete_all_games(db)
     return
 
+async def stream_games(db, query):
+    games = await db.stream_scalars(query.execution_options(yield_per=GAMES_STREAM_BATCH_SIZE))
+    async for game in games:
+        yield serialize_game(game) + '\n'
+
+async def stream_game_events(game_id, current_game):
+    # Subscribed here rather than in the view: if the client leaves before the
+    # stream starts, this never runs and there's nothing to unsubscribe.
+    queue = hub.subscribe(game_id)
+    try:
+        yield f'data: {current_game}\n\n'
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), EVENTS_KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            yield f'data: {message}\n\n'
+    finally:
+        hub.unsubscribe(game_id, queue)
+
+def decode_cursor_or_400(cursor):
+    try:
+        return pagination.decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+def get_board_parameters(input_game, game=None):
+    # A reset keeps the board of the game unless the request changes it.
+    board_size = input_game.board_size or (game.board_size if game else DEFAULT_BOARD_SIZE)
+    win_length = input_game.win_length
+    if not win_length:
+        win_length = game.win_length if game and game.board_size == board_size else board_size
+    if win_length > board_size:
+        raise HTTPException(status_code=400, detail="win_length can't be bigger than board_size.")
+    return board_size, win_length
+
 def raise_400_if_game_is_over(game):
-    if ttt.terminal(game.state):    
+    if ttt.terminal(game.state, game.win_length):    
         raise HTTPException(status_code=400, detail="This game is over.")
     
 def raise_400_if_action_is_invalid(action, game):
     if action not in ttt.actions(game.state):
         raise HTTPException(status_code=400, detail="Invalid move!")
 
-def get_ai_action(game):
-    return ttt.minimax(game.state)
+async def make_move(game, action=None, profile=None):
+    raise_400_if_game_is_over(game)
+    
+    player = ttt.player(game.state)
+    if player == game.ai_symbol:
+        action = await get_ai_action(game, profile)
+    elif action:
+        action = (action.x, action.y)
+    else:
+        raise HTTPException(status_code=400, detail="You must provide your move's coordinates (x, y)!")
+    
+    raise_400_if_action_is_invalid(action, game)
+    return apply_action(game, action)
+
+def is_ai_turn(game):
+    return not game.winner and game.current_player == game.ai_symbol
+
+async def send_game(websocket, game):
+    await websocket.send_text(serialize_game(game))
+
+def serialize_game(game):
+    return schemas.Game.model_validate(game, from_attributes=True).model_dump_json()
+
+def apply_action(game, action):
+    move = models.Move(
+        game_id=game.id,
+        round=game.round,
+        ply=sum(element is not None for row in game.state for element in row) + 1,
+        symbol=ttt.player(game.state),
+        x=action[0],
+        y=action[1],
+        created_at=models.utc_now(),
+    )
+    game.state = ttt.result(game.state, action) 
+    game.current_player = ttt.player(game.state)
+    game.winner = get_game_result(game)
+    return move
+
+async def get_ai_action(game, profile=None):
+    max_depth, mcts_iterations, random_move_chance = DIFFICULTY_LEVELS[game.difficulty]
+    # Random moves cost nothing, so weaker levels skip the search for them.
+    if random.random() < random_move_chance:
+        return random.choice(ttt.actions(game.state))
+    if game.engine == schemas.Engine.mcts:
+        return await get_mcts_action(game, mcts_iterations, profile)
+    if game.board_size == 3:
+        # 3x3 is solved, so weaker levels are read from the exact analysis
+        # too instead of searched in a worker.
+        if max_depth is not None:
+            return random.choice(ttt.horizon_moves(game.state, max_depth))
+        solved = SOLVED_GAME.get(ttt.board_key(game.state))
+        if solved:
+            return solved[1][0]
+    if profile:
+        return profile.run_search(ttt.best_move, game.state, game.win_length, AI_MOVE_TIME_BUDGET, max_depth)
+    try:
+        return await search_best_move(game.state, game.win_length, max_depth)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="The AI took too long to move, try again.")
+
+async def search_best_move(board, win_length, max_depth):
+    # Games that reach the same position, or a rotation or reflection of it,
+    # at the same time share one search. It runs on the canonical board, so
+    # every game gets the same move, mapped back onto its own board.
+    size = len(board)
+    canonical_board, cells = ttt.canonical_form(board)
+    key = (size, *ttt.to_bitboard(canonical_board), win_length, max_depth)
+    action = await search_flights.run(
+        key, workers.run_search, ttt.best_move, canonical_board, win_length, AI_MOVE_TIME_BUDGET, max_depth
+    )
+    if action is None:
+        return None
+    return divmod(cells[action[0] * size + action[1]], size)
+
+async def get_mcts_action(game, iterations=MCTS_ITERATIONS, profile=None):
+    # One tree per worker. run_searches() sends search i to worker i every
+    # time, so each tree is reused by the process that grew it. A reset starts
+    # a new round and new trees.
+    searches = [
+        (game.state, game.win_length, iterations, AI_MOVE_TIME_BUDGET,
+         (game.id, game.round, tree) if MCTS_TREE_REUSE else None)
+        for tree in range(max(AI_WORKERS, 1))
+    ]
+    if profile:
+        return mcts.pick_move([profile.run_search(mcts.search, *search) for search in searches], game.board_size)
+    try:
+        return mcts.pick_move(await workers.run_searches(mcts.search, searches), game.board_size)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="The AI took too long to move, try again.")
 
 def get_game_result(game):
     winner = None
-    is_game_over = ttt.terminal(game.state)
+    is_game_over = ttt.terminal(game.state, game.win_length)
     if is_game_over:
-        winner = ttt.winner(game.state)
+        winner = ttt.winner(game.state, game.win_length)
         if not winner:
             winner = 'draw'
     return winner
 
-def get_game_or_404(db: Session, game_id: str):
-    game = db.query(models.Game).filter(models.Game.id==game_id).first()
+async def get_game_or_404(db: AsyncSession, game_id: str):
+    if game_cache:
+        game = await game_cache.get(db, game_id)
+    else:
+        game = await db.scalar(select(models.Game).where(models.Game.id==game_id))
     if not game:
         raise HTTPException(status_code=404, detail="Game not found")
     return game 
 
-def save_game(game, db):
-    db.add(game)
-    db.commit()
+async def save_game(game, db, moves=()):
+    try:
+        if game_cache:
+            await game_cache.put(game, moves)
+        else:
+            db.add(game)
+            db.add_all(moves)
+            await db.commit()
+    except (StaleDataError, cache.GameConflict):
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="This game was changed by another request, try again.")
+    hub.publish(game.id, serialize_game(game))
 
-def delete_all_games(db: Session):
-    db.query(models.Game).delete()
-    db.commit()
\ No newline at end of file
+async def delete_all_games(db: AsyncSession):
+    if game_cache:
+        game_cache.discard_all()
+    await db.execute(delete(models.Move))
+    await db.execute(delete(models.Game))
+    await db.commit()
\ No newline at end of file
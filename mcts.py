@@ -0,0 +1,198 @@
+import math
+import random
+import time
+from collections import OrderedDict
+from threading import Lock
+import tictactoe as ttt
+from config import *
+
+# Monte Carlo Tree Search, an alternative to the alpha-beta engine for big
+# boards. Every iteration walks down the tree picking children by UCT, adds
+# one new node and finishes the game with random moves, then backs the result
+# up the path. The API grows one tree per AI worker (root parallelisation) and
+# plays the move with the most visits summed over all trees.
+#
+# With tree reuse, each process keeps the trees it grew for a game (the API
+# always sends a game's tree to the same worker), and the next search in that
+# game starts from the subtree of the position it's asked about instead of
+# from scratch. A tree is only reused for the board size and win length it
+# was grown for.
+
+DRAW_REWARD = 0.5
+
+trees = OrderedDict()
+trees_lock = Lock()
+
+
+class Node:
+    __slots__ = ('cell', 'parent', 'mover_bits', 'other_bits', 'children', 'untried', 'visits', 'reward', 'result')
+
+    def __init__(self, cell, parent, mover_bits, other_bits):
+        # mover_bits belong to the player who made the move leading here, and
+        # reward is counted from their point of view.
+        self.cell = cell
+        self.parent = parent
+        self.mover_bits = mover_bits
+        self.other_bits = other_bits
+        self.children = []
+        self.untried = []
+        self.visits = 0
+        self.reward = 0.0
+        self.result = None
+
+
+class MonteCarloSearch:
+
+    def __init__(self, size, win_length, rng=None, exploration=MCTS_EXPLORATION, stats=None):
+        self.size = size
+        self.stats = stats or ttt.SearchStats()
+        self.masks_by_cell = ttt.masks_by_cell(size, win_length)
+        self.full_board = (1 << size * size) - 1
+        self.rng = rng or random.Random()
+        self.exploration = exploration
+
+    def new_node(self, cell, parent, mover_bits, other_bits):
+        node = Node(cell, parent, mover_bits, other_bits)
+        occupied = mover_bits | other_bits
+        if cell is not None and self.wins(mover_bits, cell):
+            node.result = 1.0
+        elif occupied == self.full_board:
+            node.result = DRAW_REWARD
+        else:
+            # Popped from the end, so the most central cells are tried first.
+            node.untried = ttt.candidate_cells(occupied, self.size)[::-1]
+        return node
+
+    def wins(self, bits, cell):
+        return any(bits & mask == mask for mask in self.masks_by_cell[cell])
+
+    def iterate(self, root):
+        node, depth = root, 0
+        while node.result is None and not node.untried:
+            node = self.select(node)
+            depth += 1
+        if node.result is None:
+            cell = node.untried.pop()
+            child = self.new_node(cell, node, node.other_bits | 1 << cell, node.mover_bits)
+            node.children.append(child)
+            node = child
+            depth += 1
+
+        # Every iteration counts as one node, at the depth of the node it adds.
+        stats = self.stats
+        stats.nodes += 1
+        if depth > stats.max_depth:
+            stats.max_depth = depth
+        if stats.trace:
+            stats.trace(node.other_bits, node.mover_bits, depth)
+
+        reward = self.rollout(node)
+        while node is not None:
+            node.visits += 1
+            node.reward += reward
+            reward = 1 - reward
+            node = node.parent
+
+    def select(self, node):
+        log_visits = math.log(node.visits)
+        return max(
+            node.children,
+            key=lambda child: child.reward / child.visits + self.exploration * math.sqrt(log_visits / child.visits)
+        )
+
+    def rollout(self, node):
+        # Plays random moves to the end and returns the reward for the player
+        # who moved into node.
+        if node.result is not None:
+            return node.result
+        mover_bits, other_bits = node.mover_bits, node.other_bits
+        occupied = mover_bits | other_bits
+        free_cells = [cell for cell in range(self.size * self.size) if not occupied >> cell & 1]
+        self.rng.shuffle(free_cells)
+        for index, cell in enumerate(free_cells):
+            if index % 2:
+                mover_bits |= 1 << cell
+                if self.wins(mover_bits, cell):
+                    return 1.0
+            else:
+                other_bits |= 1 << cell
+                if self.wins(other_bits, cell):
+                    return 0.0
+        return DRAW_REWARD
+
+
+def position(board):
+    # (bits of the player who moved last, bits of the player to move)
+    x_bits, o_bits = ttt.to_bitboard(board)
+    if ttt.bitboard_player(x_bits, o_bits) == ttt.X:
+        return o_bits, x_bits
+    return x_bits, o_bits
+
+
+def search(board, win_length=None, iterations=MCTS_ITERATIONS, time_budget=AI_MOVE_TIME_BUDGET,
+           tree_key=None, seed=None, stats=None):
+    # Grows one tree and returns {cell: (visits, reward)} for the moves from
+    # the root, so results of several searches can be added up by pick_move().
+    size = len(board)
+    if ttt.terminal(board, win_length):
+        return {}
+    win_length = win_length or size
+    stats = stats or ttt.SearchStats()
+    mcts = MonteCarloSearch(size, win_length, random.Random(seed), stats=stats)
+    mover_bits, other_bits = position(board)
+    root = None
+    if tree_key is not None:
+        root = take_tree(tree_key, size, win_length, mover_bits, other_bits)
+    if root is None:
+        root = mcts.new_node(None, None, mover_bits, other_bits)
+
+    deadline = ttt.search_deadline(time_budget)
+    with ttt.recording(stats):
+        for iteration in range(iterations):
+            if not iteration & 63 and time.monotonic() > deadline:
+                break
+            mcts.iterate(root)
+
+    if tree_key is not None:
+        store_tree(tree_key, size, win_length, root)
+    return {child.cell: (child.visits, child.reward) for child in root.children}
+
+
+def pick_move(results, size):
+    visits, rewards = {}, {}
+    for result in results:
+        for cell, (cell_visits, cell_reward) in result.items():
+            visits[cell] = visits.get(cell, 0) + cell_visits
+            rewards[cell] = rewards.get(cell, 0) + cell_reward
+    if not visits:
+        return
+    cell = max(visits, key=lambda cell: (visits[cell], rewards[cell], -cell))
+    return divmod(cell, size)
+
+
+def take_tree(tree_key, size, win_length, mover_bits, other_bits):
+    with trees_lock:
+        tree = trees.pop(tree_key, None)
+    # The same bits are a different position on another board, and the
+    # rewards are wrong for another win length.
+    if tree is None or tree[:2] != (size, win_length):
+        return None
+    root = tree[2]
+    # The position is usually two plies below the stored root: the move this
+    # tree picked and the opponent's reply.
+    nodes = [root] if root else []
+    for _ in range(3):
+        for node in nodes:
+            if (node.mover_bits, node.other_bits) == (mover_bits, other_bits):
+                node.parent = None
+                return node
+        nodes = [child for node in nodes for child in node.children]
+    return None
+
+
+def store_tree(tree_key, size, win_length, root):
+    with trees_lock:
+        trees[tree_key] = (size, win_length, root)
+        trees.move_to_end(tree_key)
+        while len(trees) > MCTS_TREE_CACHE_SIZE:
+            trees.popitem(last=False)
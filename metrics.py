@@ -0,0 +1,205 @@
+import time
+from bisect import bisect_left
+from threading import Lock, local
+from sqlalchemy import event
+from config import *
+
+# Counters, gauges and histograms exported at /metrics in the Prometheus text
+# format. Every thread records into its own shard, so the hot path never
+# takes a lock; the shards are only added up when /metrics is scraped.
+
+REGISTRY = []
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.local = local()
+        self.shards = []
+        self.shards_lock = Lock()
+        REGISTRY.append(self)
+
+    def values(self, label_values):
+        try:
+            shard = self.local.shard
+        except AttributeError:
+            shard = self.local.shard = {}
+            with self.shards_lock:
+                self.shards.append(shard)
+        values = shard.get(label_values)
+        if values is None:
+            values = shard[label_values] = self.new_values()
+        return values
+
+    def new_values(self):
+        return [0]
+
+    def collect(self):
+        # {label values: values summed over the shards}
+        totals = {}
+        with self.shards_lock:
+            shards = list(self.shards)
+        for shard in shards:
+            for label_values, values in shard.copy().items():
+                total = totals.setdefault(label_values, self.new_values())
+                for index, value in enumerate(values):
+                    total[index] += value
+        return totals
+
+    def label_string(self, label_values, extra=()):
+        pairs = list(zip(self.labels, label_values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for label_values, values in sorted(self.collect().items()):
+            lines.append(f'{self.name}{self.label_string(label_values)} {format_value(values[0])}')
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        self.values(label_values)[0] += amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def inc(self, *label_values, amount=1):
+        self.values(label_values)[0] += amount
+
+    def dec(self, *label_values, amount=1):
+        self.values(label_values)[0] -= amount
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets, labels=()):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labels)
+
+    def new_values(self):
+        # One count per bucket, one for +Inf, then the sum.
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, value, *label_values):
+        values = self.values(label_values)
+        values[bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for label_values, values in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                extra = [('le', format_value(bound))]
+                lines.append(f'{self.name}_bucket{self.label_string(label_values, extra)} {cumulative}')
+            lines.append(f'{self.name}_sum{self.label_string(label_values)} {format_value(values[-1])}')
+            lines.append(f'{self.name}_count{self.label_string(label_values)} {cumulative}')
+        return lines
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_value(value):
+    return value if isinstance(value, str) else repr(value)
+
+
+def render():
+    return '\n'.join(line for metric in REGISTRY for line in metric.render()) + '\n'
+
+
+HTTP_REQUESTS = Counter('http_requests_total', 'HTTP requests', ('method', 'route', 'status'))
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency', METRICS_LATENCY_BUCKETS, ('method', 'route')
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge('http_requests_in_flight', 'HTTP requests being handled')
+AI_SEARCH_DURATION = Histogram(
+    'ai_search_duration_seconds', 'Time an AI search took in the worker', METRICS_LATENCY_BUCKETS, ('function',)
+)
+AI_SEARCH_NODES = Histogram(
+    'ai_search_nodes', 'Positions (MCTS: playouts) visited by an AI search', METRICS_NODE_BUCKETS, ('function',)
+)
+AI_SEARCHES_COALESCED = Counter(
+    'ai_searches_coalesced_total', 'AI searches that shared the result of an identical one running at the same time'
+)
+DB_QUERY_DURATION = Histogram(
+    'db_query_duration_seconds', 'Database query latency', METRICS_LATENCY_BUCKETS, ('operation',)
+)
+DB_QUERY_ERRORS = Counter('db_query_errors_total', 'Database queries that raised an error', ('operation',))
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware, so streaming responses pass straight through.
+    # Routes are labelled with their path template (/games/{game_id}), not
+    # the requested path, to keep the number of series bounded.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            route = scope.get('route')
+            path = getattr(route, 'path', 'unmatched')
+            HTTP_REQUEST_DURATION.observe(elapsed, scope['method'], path)
+            HTTP_REQUESTS.inc(scope['method'], path, str(status))
+
+
+def record_search(function, elapsed, nodes):
+    name = f'{function.__module__}.{function.__name__}'
+    AI_SEARCH_DURATION.observe(elapsed, name)
+    AI_SEARCH_NODES.observe(nodes, name)
+
+
+def instrument_engine(engine):
+    # Times every statement run by a (sync) engine, labelled by its first
+    # keyword. Pass engine.sync_engine for an async one.
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_query(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def end_query(connection, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - connection.info['query_start'].pop()
+        DB_QUERY_DURATION.observe(elapsed, query_operation(statement))
+
+    @event.listens_for(engine, 'handle_error')
+    def failed_query(context):
+        starts = context.connection.info.get('query_start') if context.connection else None
+        if starts:
+            starts.pop()
+        DB_QUERY_ERRORS.inc(query_operation(context.statement or ''))
+
+
+def query_operation(statement):
+    words = statement.split(None, 1)
+    return words[0].upper() if words else 'UNKNOWN'
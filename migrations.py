@@ -0,0 +1,62 @@
+from sqlalchemy import inspect, text
+import json
+import models
+from config import *
+
+# Data migrations for databases created by older versions of the API. Every
+# step is safe to run again, they are applied on startup after create_all.
+
+
+def encode_legacy_board_states(connection):
+    rows = connection.execute(text("SELECT id, state FROM games WHERE state LIKE '[%'")).all()
+    if not rows:
+        return
+    connection.execute(
+        text("UPDATE games SET state = :state WHERE id = :id"),
+        [
+            {'id': game_id, 'state': models.encode_state(json.loads(state))}
+            for game_id, state in rows
+        ]
+    )
+
+
+def add_column_if_missing(connection, table, column, definition):
+    columns = {existing['name'] for existing in inspect(connection).get_columns(table)}
+    if column not in columns:
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+
+
+def add_game_version_column(connection):
+    add_column_if_missing(connection, 'games', 'version', 'INTEGER NOT NULL DEFAULT 1')
+
+
+def add_game_round_column(connection):
+    add_column_if_missing(connection, 'games', 'round', 'INTEGER NOT NULL DEFAULT 1')
+
+
+def add_game_board_size_columns(connection):
+    add_column_if_missing(connection, 'games', 'board_size', f'INTEGER NOT NULL DEFAULT {DEFAULT_BOARD_SIZE}')
+    add_column_if_missing(connection, 'games', 'win_length', f'INTEGER NOT NULL DEFAULT {DEFAULT_BOARD_SIZE}')
+
+
+def add_game_engine_column(connection):
+    add_column_if_missing(connection, 'games', 'engine', f"VARCHAR NOT NULL DEFAULT '{DEFAULT_ENGINE}'")
+
+
+def add_game_difficulty_column(connection):
+    add_column_if_missing(connection, 'games', 'difficulty', f"VARCHAR NOT NULL DEFAULT '{DEFAULT_DIFFICULTY}'")
+
+
+MIGRATIONS = [
+    encode_legacy_board_states,
+    add_game_version_column,
+    add_game_round_column,
+    add_game_board_size_columns,
+    add_game_engine_column,
+    add_game_difficulty_column,
+]
+
+
+def run_migrations(connection):
+    for migration in MIGRATIONS:
+        migration(connection)
@@ -1,29 +1,56 @@
-from sqlalchemy import Column, String, TypeDecorator, types
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, TypeDecorator, UniqueConstraint, types
 from uuid import uuid4
+from datetime import datetime, timezone
 from database import Base
 import json
+from math import isqrt
 import tictactoe as ttt
 from config import *
 
-class Json(TypeDecorator):
+EMPTY_CELL = '-'
+
+
+def encode_state(state):
+    return ''.join(element or EMPTY_CELL for row in state for element in row)
+
+
+def decode_state(value):
+    size = isqrt(len(value))
+    return [
+        [None if element == EMPTY_CELL else element for element in value[i:i + size]]
+        for i in range(0, size * size, size)
+    ]
+
+
+class BoardState(TypeDecorator):
+    # Stores a board as one character per cell in row order, e.g. "X---O----".
+    # Rows written before this format hold the JSON dump of the nested lists,
+    # they're still read correctly and migrations.py rewrites them.
 
     @property
     def python_type(self):
-        return object
+        return list
 
     impl = types.String
+    cache_ok = True
 
     def process_bind_param(self, value, dialect):
-        return json.dumps(value)
+        if value is None:
+            return None
+        return encode_state(value)
 
     def process_literal_param(self, value, dialect):
         return value
 
     def process_result_value(self, value, dialect):
-        try:
-            return json.loads(value)
-        except (ValueError, TypeError):
+        if value is None:
             return None
+        if value.startswith('['):
+            try:
+                return json.loads(value)
+            except ValueError:
+                return None
+        return decode_state(value)
         
 def generate_uuid():
     return uuid4().hex[:GAME_ID_LENGTH].upper()
@@ -31,8 +58,41 @@ def generate_uuid():
 class Game(Base):
     __tablename__ = 'games'
     id = Column(String, primary_key=True, index=True, default=generate_uuid)
-    state = Column(Json, default=ttt.initial_state())
+    state = Column(BoardState, default=ttt.initial_state())
     ai_symbol = Column(String, default=DEFAULT_AI_SYMBOL)
     winner = Column(String)
     current_player = Column(String, default=DEFAULT_FIRST_PLAYER_SYMBOL)
+    # Every UPDATE is conditional on the version it was loaded with, so two
+    # requests moving in the same game can't silently overwrite each other.
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+    # Resetting a game starts a new round instead of deleting its moves. It
+    # still rewrites the rest of the row, state included.
+    round = Column(Integer, nullable=False, default=1, server_default='1')
+    board_size = Column(Integer, nullable=False, default=DEFAULT_BOARD_SIZE, server_default=str(DEFAULT_BOARD_SIZE))
+    win_length = Column(Integer, nullable=False, default=DEFAULT_BOARD_SIZE, server_default=str(DEFAULT_BOARD_SIZE))
+    engine = Column(String, nullable=False, default=DEFAULT_ENGINE, server_default=DEFAULT_ENGINE)
+    difficulty = Column(String, nullable=False, default=DEFAULT_DIFFICULTY, server_default=DEFAULT_DIFFICULTY)
+
+    __mapper_args__ = {'version_id_col': version}
+
+
+def utc_now():
+    return datetime.now(timezone.utc)
+
+class Move(Base):
+    # Append-only log of every move. Game.state is kept as a snapshot of the
+    # current round so reading a game doesn't need to replay it. That means a
+    # move is still an UPDATE of the game plus this INSERT, the log adds
+    # history rather than saving writes. The write-behind cache is what cuts
+    # them down: it updates a game once per flush, however many moves it got.
+    __tablename__ = 'moves'
+    id = Column(Integer, primary_key=True)
+    game_id = Column(String, ForeignKey('games.id', ondelete='CASCADE'), nullable=False, index=True)
+    round = Column(Integer, nullable=False)
+    ply = Column(Integer, nullable=False)
+    symbol = Column(String, nullable=False)
+    x = Column(Integer, nullable=False)
+    y = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=utc_now)
 
+    __table_args__ = (UniqueConstraint('game_id', 'round', 'ply'),)
@@ -0,0 +1,69 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import logging
+import multiprocessing
+import os
+from config import *
+
+# Listing endpoints never reveal game IDs (anyone holding one can play or reset
+# that game), so keyset cursors carry the last ID encrypted and authenticated
+# with CURSOR_SECRET rather than in the clear. It's encrypt-then-MAC with only
+# the standard library: HMAC-SHA256 of a random nonce and a block counter as
+# the keystream and a truncated HMAC-SHA256 tag, each with its own key derived
+# from the secret.
+NONCE_LENGTH = 16
+TAG_LENGTH = 16
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = hmac.new(CURSOR_SECRET, b'cursor stream', hashlib.sha256).digest()
+TAG_KEY = hmac.new(CURSOR_SECRET, b'cursor tag', hashlib.sha256).digest()
+
+
+def keystream(nonce, length):
+    # One SHA-256 digest per 32 bytes of payload, numbered by a block counter.
+    blocks = (
+        hmac.new(STREAM_KEY, nonce + counter.to_bytes(4, 'big'), hashlib.sha256).digest()
+        for counter in range(-(-length // hashlib.sha256().digest_size))
+    )
+    return b''.join(blocks)[:length]
+
+
+def sign(data):
+    return hmac.new(TAG_KEY, data, hashlib.sha256).digest()[:TAG_LENGTH]
+
+
+def check_cursor_secret():
+    # Without CURSOR_SECRET every process makes up its own, so with several
+    # workers a cursor only works on the one that issued it.
+    if 'CURSOR_SECRET' in os.environ:
+        return
+    several_workers = int(os.environ.get('WEB_CONCURRENCY', 1)) > 1 or multiprocessing.parent_process() is not None
+    if several_workers:
+        logger.warning(
+            'CURSOR_SECRET is not set, so GET /games/ cursors only work on the worker that issued them. '
+            'Set it to the same value for every worker.'
+        )
+
+
+def encode_cursor(game_id):
+    nonce = os.urandom(NONCE_LENGTH)
+    plain = game_id.encode()
+    sealed = bytes(a ^ b for a, b in zip(plain, keystream(nonce, len(plain))))
+    token = nonce + sealed + sign(nonce + sealed)
+    return base64.urlsafe_b64encode(token).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        token = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    except (ValueError, binascii.Error):
+        raise ValueError('Invalid cursor')
+
+    nonce, sealed, tag = token[:NONCE_LENGTH], token[NONCE_LENGTH:-TAG_LENGTH], token[-TAG_LENGTH:]
+    if not sealed or not hmac.compare_digest(tag, sign(nonce + sealed)):
+        raise ValueError('Invalid cursor')
+    plain = bytes(a ^ b for a, b in zip(sealed, keystream(nonce, len(sealed))))
+    return plain.decode(errors='replace')
@@ -0,0 +1,44 @@
+import asyncio
+import cProfile
+import io
+import pstats
+import tictactoe as ttt
+from config import *
+
+# Profiling of single requests, for finding out why an AI move is slow on a
+# staging server (DEBUG_PROFILING). AI searches of a profiled request run in
+# the request itself instead of the worker pool, so they show up in the
+# profile, and each one reports its ttt.SearchStats.
+#
+# The profiler sees everything the event loop runs while the request is
+# waiting, so other requests can show up in the summary too. Only one request
+# is profiled at a time.
+
+lock = asyncio.Lock()
+
+
+class RequestProfile:
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.searches = []
+
+    async def __aenter__(self):
+        await lock.acquire()
+        self.profiler.enable()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.profiler.disable()
+        lock.release()
+
+    def run_search(self, function, *args):
+        stats = ttt.SearchStats()
+        result = function(*args, stats=stats)
+        self.searches.append({'function': f'{function.__module__}.{function.__name__}', **stats.as_dict()})
+        return result
+
+    def report(self, lines=DEBUG_PROFILE_LINES):
+        stream = io.StringIO()
+        pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(lines)
+        return {'searches': self.searches, 'profile': stream.getvalue()}
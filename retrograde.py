@@ -0,0 +1,135 @@
+import argparse
+import time
+import numpy as np
+import tictactoe as ttt
+
+# Solves the whole game at once with NumPy. Every 3x3 board is an index into
+# arrays of length 3^9, with cell (i, j) as the base-3 digit i * 3 + j (0 empty,
+# 1 X, 2 O). Legality, winners and terminal positions are computed for all
+# boards with vectorised operations, then values are backed up from the last
+# ply to the first (retrograde analysis), one ply per step.
+#
+#   python retrograde.py --verify --export solution.npz
+
+EMPTY, X, O = 0, 1, 2
+BOARDS = 3 ** 9
+POWERS = 3 ** np.arange(9)
+NO_MOVE = -1
+
+
+class Solution:
+
+    def __init__(self, legal, terminal, values, best_moves):
+        # All arrays are indexed by board_index(). values are from X's point of
+        # view like ttt.utility(), best_moves hold the cell (i * 3 + j) of the
+        # first optimal move in actions() order, or NO_MOVE.
+        self.legal = legal
+        self.terminal = terminal
+        self.values = values
+        self.best_moves = best_moves
+
+    def export(self, path):
+        np.savez_compressed(
+            path, legal=self.legal, terminal=self.terminal, values=self.values, best_moves=self.best_moves
+        )
+
+
+def board_index(board):
+    symbols = {ttt.X: X, ttt.O: O}
+    return sum(symbols.get(element, EMPTY) * 3 ** (i * 3 + j)
+               for i, row in enumerate(board) for j, element in enumerate(row))
+
+
+def index_to_board(index):
+    symbols = {EMPTY: ttt.EMPTY, X: ttt.X, O: ttt.O}
+    digits = index // POWERS % 3
+    return [[symbols[int(digits[i * 3 + j])] for j in range(3)] for i in range(3)]
+
+
+def solve():
+    indexes = np.arange(BOARDS)
+    digits = indexes[:, None] // POWERS % 3
+    bit_values = 1 << np.arange(9)
+    x_bits = (digits == X) @ bit_values
+    o_bits = (digits == O) @ bit_values
+
+    is_win = np.array(ttt.IS_WIN)
+    x_wins, o_wins = is_win[x_bits], is_win[o_bits]
+    x_count, o_count = (digits == X).sum(axis=1), (digits == O).sum(axis=1)
+    x_to_move = x_count == o_count
+
+    # X moves first, so it has as many symbols as O or one more. Nobody moves
+    # after a win, so the winner made the last move and only one side can win.
+    legal = (
+        (x_to_move | (x_count == o_count + 1))
+        & ~(x_wins & o_wins)
+        & ~(x_wins & x_to_move)
+        & ~(o_wins & ~x_to_move)
+    )
+    terminal = legal & (x_wins | o_wins | (x_count + o_count == 9))
+
+    values = np.zeros(BOARDS, dtype=np.int8)
+    values[x_wins] = 1
+    values[o_wins] = -1
+    best_moves = np.full(BOARDS, NO_MOVE, dtype=np.int8)
+
+    plies = x_count + o_count
+    for ply in range(8, -1, -1):
+        positions = indexes[legal & ~terminal & (plies == ply)]
+        if not len(positions):
+            continue
+        movers = np.where(x_to_move[positions], X, O)
+        empty = digits[positions] == EMPTY
+        children = positions[:, None] + empty * movers[:, None] * POWERS
+        # X picks the highest child value and O the lowest, so flip O's values
+        # and take the first maximum, which is the first optimal move in
+        # actions() order. Occupied cells get a value below any real one.
+        signs = np.where(movers == X, 1, -1)[:, None]
+        child_values = np.where(empty, values[children] * signs, -2)
+        best_moves[positions] = child_values.argmax(axis=1)
+        values[positions] = child_values.max(axis=1) * signs[:, 0]
+
+    return Solution(legal, terminal, values, best_moves)
+
+
+def verify(solution):
+    # Compares the solution with the search engine on every legal position and
+    # returns the indexes where they disagree.
+    solved_game = ttt.solve_game()
+    mismatches = []
+    for index in np.flatnonzero(solution.legal):
+        board = index_to_board(index)
+        value, optimal_actions = solved_game[ttt.board_key(board)]
+        if solution.values[index] != value:
+            mismatches.append(int(index))
+        elif solution.terminal[index]:
+            if solution.best_moves[index] != NO_MOVE:
+                mismatches.append(int(index))
+        elif ttt.CELLS[solution.best_moves[index]] != ttt.minimax(board):
+            mismatches.append(int(index))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Solve tic-tac-toe with NumPy retrograde analysis.')
+    parser.add_argument('--export', metavar='PATH', help='save the solution as a .npz file')
+    parser.add_argument('--verify', action='store_true', help='check the solution against minimax')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    solution = solve()
+    elapsed = time.perf_counter() - start
+    print(f'Solved {solution.legal.sum()} legal positions in {elapsed * 1000:.1f} ms')
+
+    if args.export:
+        solution.export(args.export)
+        print(f'Saved to {args.export}')
+    if args.verify:
+        mismatches = verify(solution)
+        print(f'{len(mismatches)} positions disagree with minimax')
+        if mismatches:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
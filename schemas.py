@@ -2,6 +2,7 @@ from pydantic import BaseModel, conint, Field
 from enum import Enum
 from config import *
 from typing import Annotated
+from datetime import datetime
 
 
 class Symbol(str, Enum):
@@ -13,23 +14,57 @@ class Result(str, Enum):
     X = 'X'
     draw = 'draw'
 
+class Engine(str, Enum):
+    minimax = 'minimax'
+    mcts = 'mcts'
+
+class Difficulty(str, Enum):
+    easy = 'easy'
+    medium = 'medium'
+    hard = 'hard'
+
 class Action(BaseModel):
-    x: conint(ge=0, le=2)
-    y: conint(ge=0, le=2)
+    x: conint(ge=0, le=MAX_BOARD_SIZE - 1)
+    y: conint(ge=0, le=MAX_BOARD_SIZE - 1)
 
 STATE_ROW = Annotated[
     list[
         Symbol | None
     ], Field(min_length=3, max_length=3)]
 
+STATE = Annotated[list[STATE_ROW], Field(min_length=3, max_length=3)]
+
+BOARD_ROW = Annotated[
+    list[
+        Symbol | None
+    ], Field(min_length=MIN_BOARD_SIZE, max_length=MAX_BOARD_SIZE)]
+
+BOARD = Annotated[list[BOARD_ROW], Field(min_length=MIN_BOARD_SIZE, max_length=MAX_BOARD_SIZE)]
+
 class GameBase(BaseModel):
     ai_symbol: Symbol = Field(
         default=DEFAULT_AI_SYMBOL, 
         description=f'Symbol ("O" or "X"), default: {DEFAULT_AI_SYMBOL} which is used by the AI')
 
 class Game(GameBase):
-    state: Annotated[list[STATE_ROW], Field(min_length=3, max_length=3)] = Field(
-        description='A 3x3 grid representing current state of the game'
+    state: BOARD = Field(
+        description='A board_size x board_size grid representing current state of the game'
+    )
+    board_size: int = Field(
+        default=DEFAULT_BOARD_SIZE,
+        description='Number of rows and columns of the board'
+    )
+    win_length: int = Field(
+        default=DEFAULT_BOARD_SIZE,
+        description='Number of symbols in a row (horizontally, vertically or diagonally) needed to win'
+    )
+    engine: Engine = Field(
+        default=DEFAULT_ENGINE,
+        description='AI engine, "minimax" (alpha-beta search) or "mcts" (Monte Carlo Tree Search)'
+    )
+    difficulty: Difficulty = Field(
+        default=DEFAULT_DIFFICULTY,
+        description='How strong the AI is, "hard" plays perfectly on 3x3 boards'
     )
     
     winner: Result | None = Field(
@@ -42,7 +77,50 @@ class Game(GameBase):
     )
 
 class CreateGame(GameBase):
-    pass
+    engine: Engine | None = Field(
+        default=None,
+        description=f'AI engine ("minimax" or "mcts"), default: {DEFAULT_ENGINE} for a new game, unchanged on reset'
+    )
+    difficulty: Difficulty | None = Field(
+        default=None,
+        description=f'How strong the AI is ("easy", "medium" or "hard"), default: {DEFAULT_DIFFICULTY} for a new game, unchanged on reset'
+    )
+    board_size: conint(ge=MIN_BOARD_SIZE, le=MAX_BOARD_SIZE) | None = Field(
+        default=None,
+        description=f'Number of rows and columns of the board, default: {DEFAULT_BOARD_SIZE} for a new game, unchanged on reset'
+    )
+    win_length: conint(ge=MIN_WIN_LENGTH, le=MAX_BOARD_SIZE) | None = Field(
+        default=None,
+        description='Number of symbols in a row needed to win, at most board_size, default: board_size'
+    )
 
 class GameWithId(Game):
     id: str
+
+class Move(BaseModel):
+    ply: int = Field(description='Number of the move in its round, starting from 1')
+    symbol: Symbol
+    x: int
+    y: int
+    created_at: datetime
+
+class AIMovesRequest(BaseModel):
+    boards: Annotated[list[STATE], Field(min_length=1, max_length=AI_MOVES_MAX_BATCH_SIZE)] = Field(
+        description='3x3 grids to find the AI\'s move for, the move is made for the player whose turn it is'
+    )
+
+class AIMovesResponse(BaseModel):
+    moves: list[Action | None] = Field(
+        description='Optimal move for each board, in the same order, or None if the game on that board is over'
+    )
+
+class AnalyzeRequest(BaseModel):
+    state: STATE = Field(description='A 3x3 grid to analyze for the player whose turn it is')
+
+class MoveAnalysis(Action):
+    value: int = Field(description='1 if this move wins for the player making it, 0 if it draws, -1 if it loses, with perfect play')
+    plies: int = Field(description='How many moves, this one included, are left until the game ends with perfect play')
+
+class Analysis(BaseModel):
+    player: Symbol = Field(description='Symbol ("O" or "X") of the player whose moves are analyzed')
+    moves: list[MoveAnalysis] = Field(description='Every legal move, empty if the game is over')
@@ -0,0 +1,88 @@
+import asyncio
+from concurrent.futures import CancelledError, Future
+from threading import Lock
+
+# Single-flight calls: while a computation for a key is running, everyone else
+# asking for the same key waits for it and gets its result (or exception)
+# instead of starting their own. Nothing is cached, the key is forgotten as
+# soon as the computation finishes. Threads use call() and coroutines run(),
+# and both can wait on the same computation.
+
+
+class SingleFlight:
+
+    def __init__(self, on_shared=None):
+        self.calls = {}
+        self.lock = Lock()
+        # Called whenever a caller gets someone else's result, e.g. for metrics.
+        self.on_shared = on_shared
+
+    def join(self, key):
+        # Returns (future, True) if the caller has to compute the result itself.
+        with self.lock:
+            future = self.calls.get(key)
+            if future is not None:
+                return future, False
+            future = self.calls[key] = Future()
+            return future, True
+
+    def finish(self, key, future, result=None, exception=None):
+        with self.lock:
+            del self.calls[key]
+        if exception is None:
+            future.set_result(result)
+        elif isinstance(exception, (CancelledError, asyncio.CancelledError)):
+            # The caller computing it went away, the others start over.
+            future.cancel()
+        else:
+            future.set_exception(exception)
+
+    def shared(self):
+        if self.on_shared:
+            self.on_shared()
+
+    def call(self, key, function, *args):
+        while True:
+            future, leader = self.join(key)
+            if leader:
+                break
+            try:
+                result = future.result()
+            except CancelledError:
+                if future.cancelled():
+                    continue
+                raise
+            self.shared()
+            return result
+
+        try:
+            result = function(*args)
+        except BaseException as exception:
+            self.finish(key, future, exception=exception)
+            raise
+        self.finish(key, future, result)
+        return result
+
+    async def run(self, key, coroutine_function, *args):
+        while True:
+            future, leader = self.join(key)
+            if leader:
+                break
+            try:
+                # Shielded, so a waiter that is cancelled doesn't cancel the
+                # computation for everyone else.
+                result = await asyncio.shield(asyncio.wrap_future(future))
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    continue
+                raise
+            self.shared()
+            return result
+
+        try:
+            result = await coroutine_function(*args)
+        except BaseException as exception:
+            self.finish(key, future, exception=exception)
+            raise
+        self.finish(key, future, result)
+        return result
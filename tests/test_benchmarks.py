@@ -0,0 +1,41 @@
+import tictactoe as ttt
+from benchmarks import engine, load
+
+
+def test_corpus_positions_are_reachable():
+    solved_game = ttt.solve_game()
+    for boards in engine.CORPUS.values():
+        assert all(ttt.board_key(board) in solved_game for board in boards)
+
+
+def test_count_nodes():
+    nodes = engine.count_nodes(engine.CORPUS['endgame'])
+    assert nodes > 0
+    assert nodes == engine.count_nodes(engine.CORPUS['endgame'])
+
+
+def test_compare():
+    baseline = {
+        'minimax/opening': {'ops_per_sec': 1000, 'relative': 0.1, 'nodes': 100},
+        'winner/opening': {'ops_per_sec': 1000, 'relative': 0.5},
+    }
+    # Raw throughput alone doesn't count, only throughput relative to the
+    # calibration loop and node counts.
+    assert engine.compare({'minimax/opening': {'ops_per_sec': 10, 'relative': 0.09, 'nodes': 100}}, baseline, 0.2) == []
+    assert [name for name, _ in engine.compare({
+        'minimax/opening': {'ops_per_sec': 1000, 'relative': 0.1, 'nodes': 101},
+        'winner/opening': {'ops_per_sec': 1000, 'relative': 0.35},
+        'player/opening': {'ops_per_sec': 1, 'relative': 0.001},
+    }, baseline, 0.2)] == ['minimax/opening', 'winner/opening']
+
+
+def test_measure():
+    result = engine.measure(engine.calibration, engine.CORPUS['opening'])
+    assert result['ops_per_sec'] > 0
+    assert 0.5 < result['relative'] < 2
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert [load.percentile(values, p) for p in (50, 95, 99, 100)] == [50, 95, 99, 100]
+    assert load.percentile([7], 99) == 7
@@ -0,0 +1,21 @@
+from events import BroadcastHub
+
+
+def test_publish_fans_out_to_subscribers():
+    hub = BroadcastHub()
+    first, second, other = hub.subscribe('A'), hub.subscribe('A'), hub.subscribe('B')
+    hub.publish('A', 'update')
+    assert first.get_nowait() == second.get_nowait() == 'update'
+    assert other.empty()
+
+    hub.unsubscribe('A', first)
+    hub.unsubscribe('A', second)
+    assert 'A' not in hub.subscribers
+
+
+def test_slow_subscriber_keeps_newest_updates():
+    hub = BroadcastHub(queue_size=2)
+    queue = hub.subscribe('A')
+    for update in ['1', '2', '3']:
+        hub.publish('A', update)
+    assert [queue.get_nowait(), queue.get_nowait()] == ['2', '3']
@@ -1,26 +1,37 @@
+from fastapi import HTTPException, WebSocketDisconnect
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import NullPool
+from tempfile import mkdtemp
+import json
+import asyncio
+import pytest
 from database import Base
-from main import app, get_db
+from main import app, get_db, get_game_or_404, save_game
 from config import *
-from models import Game
+from models import Game, Move, utc_now
+from migrations import run_migrations
+from cache import GameCache, GameConflict
+import main
+import pagination
+import tictactoe as ttt
 
-SQLALCHEMY_DATABASE_URL = "sqlite://"
+# The app talks to the database through an async engine while the helpers
+# below use a sync one, so both point at the same temporary file.
+TEST_DATABASE_PATH = f'{mkdtemp()}/test.db'
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
+    f"sqlite:///{TEST_DATABASE_PATH}",
     connect_args={"check_same_thread": False},
-    poolclass=StaticPool,
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base.metadata.create_all(bind=engine)
-def override_get_db():
-    try:
-        db = TestingSessionLocal()
+async_engine = create_async_engine(f"sqlite+aiosqlite:///{TEST_DATABASE_PATH}", poolclass=NullPool)
+AsyncTestingSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+async def override_get_db():
+    async with AsyncTestingSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 app.dependency_overrides[get_db] = override_get_db
 
@@ -28,6 +39,7 @@ app.dependency_overrides[get_db] = override_get_db
 
 client = TestClient(app)
 TEST_INVALID_ID = 'x'*GAME_ID_LENGTH
+LEGACY_GAME_ID = 'L'*GAME_ID_LENGTH
 VALID_INITIAL_STATE = [[None, None, None], [None, None, None], [None, None, None]]
 VALID_SYMBOLS = ['X', 'O']
 TEST_GAMES_NUMBER = 3
@@ -47,6 +59,10 @@ def clear_games_db():
         db.query(Game).delete()
         db.commit()
 
+def get_all_game_ids():
+    with TestingSessionLocal() as db:
+        return [game.id for game in db.query(Game).all()]
+
 def is_db_empty():
     with TestingSessionLocal() as db:
         return db.query(Game).count() == 0
@@ -311,6 +327,70 @@ def test_get_games_on_empty_db():
         print(f'\tValidating using validator {j}: {validator.__name__}')
         assert validator(response)
 
+def test_get_games_pagination():
+    clear_games_db()
+    populate_games_db()
+
+    print('Testing get games endpoint pagination')
+    first_page = client.get('/games/', params={'limit': 2})
+    assert is_status_200(first_page)
+    assert len(first_page.json()) == 2
+    cursor = first_page.headers['X-Next-Cursor']
+    assert all(game_id not in cursor for game_id in get_all_game_ids())
+
+    second_page = client.get('/games/', params={'limit': 2, 'cursor': cursor})
+    assert is_status_200(second_page)
+    assert len(second_page.json()) == TEST_GAMES_NUMBER - 2
+    assert 'X-Next-Cursor' not in second_page.headers
+
+    assert is_status_4xx(client.get('/games/', params={'cursor': 'foo'}))
+
+
+def test_cursor_round_trip():
+    print('Testing that cursors of any length decode to the same ID')
+    for game_id in ['A' * GAME_ID_LENGTH, 'x' * 100, 'ż' * 40]:
+        assert pagination.decode_cursor(pagination.encode_cursor(game_id)) == game_id
+
+
+def test_cursor_secret_warning(monkeypatch, caplog):
+    print('Testing the warning about a missing cursor secret with several workers')
+    monkeypatch.delenv('CURSOR_SECRET', raising=False)
+    monkeypatch.delenv('WEB_CONCURRENCY', raising=False)
+    pagination.check_cursor_secret()
+    assert 'CURSOR_SECRET' not in caplog.text
+
+    monkeypatch.setenv('WEB_CONCURRENCY', '4')
+    pagination.check_cursor_secret()
+    assert 'CURSOR_SECRET is not set' in caplog.text
+
+    caplog.clear()
+    monkeypatch.setenv('CURSOR_SECRET', 'secret')
+    pagination.check_cursor_secret()
+    assert 'CURSOR_SECRET' not in caplog.text
+
+
+def test_get_games_filters():
+    clear_games_db()
+    populate_games_db()
+
+    print('Testing get games endpoint filters')
+    response = client.get('/games/', params={'ai_symbol': DEFAULT_AI_SYMBOL})
+    assert contains_test_games_number_entries(response)
+    response = client.get('/games/', params={'winner': 'draw'})
+    assert is_response_empty(response)
+
+def test_get_games_stream():
+    clear_games_db()
+    populate_games_db()
+
+    print('Testing get games endpoint in streaming mode')
+    response = client.get('/games/', params={'stream': True})
+    assert is_status_200(response)
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    games = [json.loads(line) for line in response.text.splitlines()]
+    assert len(games) == TEST_GAMES_NUMBER
+    assert all(game['state'] == VALID_INITIAL_STATE for game in games)
+
 def test_get_game_valid_id_payload():
     valid_game_id = populate_games_db()[0]
     response = client.get(f'/games/{valid_game_id}')
@@ -319,6 +399,27 @@ def test_get_game_valid_id_payload():
         print(f'\tValidating using validator {j}: {validator.__name__}')
         assert validator(response)
 
+def test_get_game_with_legacy_json_state():
+    print('Testing get game endpoint on a row saved in the legacy JSON format')
+    legacy_state = [[None, 'X', None], [None, None, None], [None, 'O', None]]
+    with engine.begin() as connection:
+        connection.execute(
+            text("INSERT INTO games (id, state, ai_symbol, current_player) VALUES (:id, :state, 'O', 'X')"),
+            {'id': LEGACY_GAME_ID, 'state': json.dumps(legacy_state)}
+        )
+
+    response = client.get(f'/games/{LEGACY_GAME_ID}')
+    assert is_status_200(response)
+    assert response.json()['state'] == legacy_state
+
+    with engine.begin() as connection:
+        run_migrations(connection)
+        stored_state = connection.execute(
+            text("SELECT state FROM games WHERE id = :id"), {'id': LEGACY_GAME_ID}
+        ).scalar()
+    assert stored_state == '-X-----O-'
+    assert client.get(f'/games/{LEGACY_GAME_ID}').json()['state'] == legacy_state
+
 def test_get_game_invalid_id_payload():
     response = client.get(f'/games/{TEST_INVALID_ID}')
     print('Testing get game endpoint with invalid ID')
@@ -400,6 +501,410 @@ def test_game_simulation():
         print(f'actual response: {response.json()}')
         assert response.json() == expected_response
 
+
+def test_game_action_with_ai_reply():
+    print('Testing game action with AI reply in the same request')
+    game_id = populate_games_db()[0]
+    response = client.patch(
+        f'/games/{game_id}',
+        params={'ai_reply': True},
+        json={"x": 1, "y": 1}
+    )
+    assert is_status_200(response)
+    assert response.json()['state'] == [['O', None, None], [None, 'X', None], [None, None, None]]
+    assert response.json()['current_player'] == 'X'
+
+    for action in [{"x": 0, "y": 2}, {"x": 2, "y": 2}]:
+        response = client.patch(f'/games/{game_id}', params={'ai_reply': True}, json=action)
+    assert response.json()['winner'] == 'O'
+    assert response.json()['state'] == [['O', None, 'X'], ['O', 'X', None], ['O', None, 'X']]
+
+
+def test_bigger_board_game():
+    print('Testing a game on a 4x4 board with three in a row to win')
+    response = client.post('/games/', json={'board_size': 4, 'win_length': 3})
+    assert is_status_200(response)
+    game_id = response.json()['id']
+    assert response.json()['state'] == [[None] * 4 for _ in range(4)]
+    assert (response.json()['board_size'], response.json()['win_length']) == (4, 3)
+
+    # The AI search depends on the time budget, so only check that it plays legal moves.
+    while not response.json()['winner']:
+        state = response.json()['state']
+        x, y = next((x, y) for x in range(4) for y in range(4) if state[x][y] is None)
+        response = client.patch(f'/games/{game_id}', params={'ai_reply': True}, json={'x': x, 'y': y})
+        assert is_status_200(response)
+        new_state = response.json()['state']
+        assert new_state[x][y] == 'X'
+        assert sum(row.count('X') for row in new_state) - sum(row.count('O') for row in new_state) in {0, 1}
+    assert response.json()['winner'] in {'X', 'O', 'draw'}
+
+    assert is_status_4xx(client.post('/games/', json={'board_size': 4, 'win_length': 5}))
+    assert is_status_4xx(client.post('/games/', json={'board_size': MAX_BOARD_SIZE + 1}))
+
+    response = client.put(f'/games/{game_id}', json={'board_size': 3})
+    assert is_status_200(response)
+    assert response.json()['state'] == VALID_INITIAL_STATE
+    assert (response.json()['board_size'], response.json()['win_length']) == (3, 3)
+    assert client.patch(f'/games/{game_id}', json={'x': 3, 'y': 0}).status_code == 400
+
+
+def test_mcts_game(monkeypatch):
+    print('Testing a game against the MCTS engine')
+    monkeypatch.setitem(main.DIFFICULTY_LEVELS, 'hard', (None, 500, 0))
+    response = client.post('/games/', json={'board_size': 4, 'win_length': 3, 'engine': 'mcts'})
+    assert is_status_200(response)
+    assert response.json()['engine'] == 'mcts'
+    game_id = response.json()['id']
+
+    for _ in range(2):
+        state = response.json()['state']
+        x, y = next((x, y) for x in range(4) for y in range(4) if state[x][y] is None)
+        response = client.patch(f'/games/{game_id}', params={'ai_reply': True}, json={'x': x, 'y': y})
+        assert is_status_200(response)
+    state = response.json()['state']
+    assert sum(row.count('O') for row in state) == sum(row.count('X') for row in state) == 2
+
+    # The trees grown for the 4x4 board must not be reused on a 3x3 one.
+    response = client.put(f'/games/{game_id}', json={'ai_symbol': 'X', 'board_size': 3})
+    assert response.json()['engine'] == 'mcts'
+    response = client.patch(f'/games/{game_id}')
+    assert is_status_200(response)
+    assert sum(row.count('X') for row in response.json()['state']) == 1
+    response = client.put(f'/games/{game_id}', json={'engine': 'minimax'})
+    assert response.json()['engine'] == 'minimax'
+    assert is_status_4xx(client.post('/games/', json={'engine': 'foo'}))
+
+
+def test_game_difficulty(monkeypatch):
+    print('Testing games against weaker AI levels')
+    response = client.post('/games/', json={'difficulty': 'easy'})
+    assert is_status_200(response)
+    assert response.json()['difficulty'] == 'easy'
+    game_id = response.json()['id']
+
+    # 3x3 levels are read from the analysis, without a search.
+    monkeypatch.setattr(main, 'search_best_move', lambda *args: pytest.fail('searched a 3x3 board'))
+
+    # Only random moves: the AI doesn't block the top row.
+    monkeypatch.setitem(main.DIFFICULTY_LEVELS, 'easy', (1, 200, 1))
+    monkeypatch.setattr(main.random, 'choice', lambda actions: actions[-1])
+    client.patch(f'/games/{game_id}', params={'ai_reply': True}, json={'x': 0, 'y': 0})
+    response = client.patch(f'/games/{game_id}', params={'ai_reply': True}, json={'x': 0, 'y': 1})
+    assert response.json()['state'] == [['X', 'X', None], [None, None, None], [None, 'O', 'O']]
+
+    # No random moves, but a two ply search still sees the threat.
+    monkeypatch.setitem(main.DIFFICULTY_LEVELS, 'easy', (2, 200, 0))
+    response = client.put(f'/games/{game_id}', json={})
+    assert response.json()['difficulty'] == 'easy'
+    client.patch(f'/games/{game_id}', params={'ai_reply': True}, json={'x': 2, 'y': 2})
+    response = client.patch(f'/games/{game_id}', params={'ai_reply': True}, json={'x': 0, 'y': 2})
+    assert response.json()['state'][1][2] == 'O'
+
+    response = client.put(f'/games/{game_id}', json={'difficulty': 'hard'})
+    assert response.json()['difficulty'] == 'hard'
+    assert is_status_4xx(client.post('/games/', json={'difficulty': 'impossible'}))
+
+    # Bigger boards still use a depth-limited search.
+    monkeypatch.undo()
+    searches = []
+    search_best_move = main.search_best_move
+    async def record_search(board, win_length, max_depth):
+        searches.append(max_depth)
+        return await search_best_move(board, win_length, max_depth)
+    monkeypatch.setattr(main, 'search_best_move', record_search)
+    monkeypatch.setitem(main.DIFFICULTY_LEVELS, 'medium', (2, 2000, 0))
+    game_id = client.post('/games/', json={'board_size': 4, 'difficulty': 'medium'}).json()['id']
+    assert is_status_200(client.patch(f'/games/{game_id}', params={'ai_reply': True}, json={'x': 0, 'y': 0}))
+    assert searches == [2]
+
+
+def test_save_game_conflict():
+    print('Testing that saving a game changed by another request fails with 409')
+    game_id = populate_games_db()[0]
+
+    async def save_stale_game():
+        async with AsyncTestingSessionLocal() as db:
+            game = await get_game_or_404(db, game_id)
+            with engine.begin() as connection:
+                connection.execute(
+                    text("UPDATE games SET version = version + 1 WHERE id = :id"), {'id': game_id}
+                )
+            game.winner = 'X'
+            with pytest.raises(HTTPException) as error:
+                await save_game(game, db)
+            return error.value.status_code
+
+    assert asyncio.run(save_stale_game()) == 409
+    assert is_valid_initial_winner(client.get(f'/games/{game_id}'))
+
+
+def test_game_moves_log():
+    print('Testing the move log of a game')
+    game_id = populate_games_db()[0]
+    for action in [{"x": 1, "y": 1}, {"x": 0, "y": 2}]:
+        client.patch(f'/games/{game_id}', params={'ai_reply': True}, json=action)
+
+    response = client.get(f'/games/{game_id}/moves')
+    assert is_status_200(response)
+    moves = [(move['ply'], move['symbol'], move['x'], move['y']) for move in response.json()]
+    assert moves == [(1, 'X', 1, 1), (2, 'O', 0, 0), (3, 'X', 0, 2), (4, 'O', 2, 0)]
+
+    client.put(f'/games/{game_id}', json={})
+    assert is_response_empty(client.get(f'/games/{game_id}/moves'))
+    with TestingSessionLocal() as db:
+        assert db.query(Move).filter(Move.game_id == game_id).count() == 4
+
+
+def test_game_websocket():
+    print('Testing a game played over the WebSocket endpoint')
+    game_id = client.post('/games/', json={'ai_symbol': 'X'}).json()['id']
+    with client.websocket_connect(f'/games/{game_id}/ws') as websocket:
+        assert websocket.receive_json()['state'] == VALID_INITIAL_STATE
+        assert websocket.receive_json()['state'][0][0] == 'X'
+
+        websocket.send_json({'x': 1, 'y': 1})
+        assert websocket.receive_json()['state'][1][1] == 'O'
+        ai_reply = websocket.receive_json()
+        assert ai_reply['current_player'] == 'O'
+        assert sum(element is not None for row in ai_reply['state'] for element in row) == 3
+
+        websocket.send_json({'x': 1, 'y': 1})
+        assert websocket.receive_json() == {'detail': 'Invalid move!'}
+        websocket.send_json({'x': 5, 'y': 1})
+        assert websocket.receive_json() == {'detail': 'Invalid move!'}
+
+    assert client.get(f'/games/{game_id}').json() == ai_reply
+
+def test_game_websocket_releases_connection():
+    print('Testing that an idle WebSocket game holds no database connection')
+    game_id = populate_games_db()[0]
+    checked_out = []
+    on_checkout = lambda *args: checked_out.append(1)
+    on_checkin = lambda *args: checked_out.append(-1)
+    event.listen(async_engine.sync_engine, 'checkout', on_checkout)
+    event.listen(async_engine.sync_engine, 'checkin', on_checkin)
+    try:
+        with client.websocket_connect(f'/games/{game_id}/ws') as websocket:
+            assert websocket.receive_json()['state'] == VALID_INITIAL_STATE
+            assert sum(checked_out) == 0
+            websocket.send_json({'x': 1, 'y': 1})
+            websocket.receive_json()
+            websocket.receive_json()
+            assert sum(checked_out) == 0
+
+            websocket.send_text('not json')
+            assert websocket.receive_json() == {'detail': 'Invalid move!'}
+            websocket.send_bytes(b'{"x": 0, "y": 0}')
+            assert websocket.receive_json() == {'detail': 'Invalid move!'}
+    finally:
+        event.remove(async_engine.sync_engine, 'checkout', on_checkout)
+        event.remove(async_engine.sync_engine, 'checkin', on_checkin)
+
+def test_game_websocket_invalid_id():
+    print('Testing the WebSocket endpoint with invalid ID')
+    with pytest.raises(WebSocketDisconnect) as error:
+        with client.websocket_connect(f'/games/{TEST_INVALID_ID}/ws') as websocket:
+            websocket.receive_json()
+    assert error.value.code == WS_CLOSE_GAME_NOT_FOUND
+
+
+def test_game_events_published_on_change():
+    print('Testing that game changes are published to spectators')
+    game_id = populate_games_db()[0]
+    queue = main.hub.subscribe(game_id)
+    try:
+        response = client.patch(f'/games/{game_id}', params={'ai_reply': True}, json={"x": 1, "y": 1})
+        client.put(f'/games/{game_id}', json={})
+        assert queue.qsize() == 2
+        assert json.loads(queue.get_nowait()) == response.json()
+        assert json.loads(queue.get_nowait())['state'] == VALID_INITIAL_STATE
+    finally:
+        main.hub.unsubscribe(game_id, queue)
+
+def test_game_events_stream():
+    print('Testing the server-sent events stream of a game')
+    game_id = populate_games_db()[0]
+
+    async def read_events():
+        stream = main.stream_game_events(game_id, '{"current": true}')
+        # Nothing is subscribed until the stream starts.
+        assert game_id not in main.hub.subscribers
+        received = [await anext(stream)]
+        main.hub.publish(game_id, '{"current": false}')
+        received.append(await anext(stream))
+        await stream.aclose()
+        return received
+
+    assert asyncio.run(read_events()) == ['data: {"current": true}\n\n', 'data: {"current": false}\n\n']
+    assert game_id not in main.hub.subscribers
+
+    # A client that leaves before the stream starts leaves no subscriber.
+    async def drop_response():
+        async with AsyncTestingSessionLocal() as db:
+            await main.game_events_view(game_id, db)
+
+    asyncio.run(drop_response())
+    assert game_id not in main.hub.subscribers
+    assert is_status_404(client.get(f'/games/{TEST_INVALID_ID}/events'))
+
+
+def test_ai_moves_batch():
+    print('Testing the batch AI moves endpoint')
+    boards = [
+        VALID_INITIAL_STATE,
+        [[None, None, None], [None, 'X', None], [None, None, None]],
+        [['O', None, 'X'], [None, 'X', None], ['O', None, 'X']],
+        [[None, None, None], [None, 'X', None], [None, None, None]],
+        [['O', None, 'X'], ['O', 'X', None], ['O', None, 'X']],
+    ]
+    response = client.post('/ai/moves', json={'boards': boards})
+    assert is_status_200(response)
+    assert response.json()['moves'] == [
+        {'x': 0, 'y': 0}, {'x': 0, 'y': 0}, {'x': 1, 'y': 0}, {'x': 0, 'y': 0}, None
+    ]
+
+    unreachable_board = [['X', 'X', None], [None, None, None], [None, None, None]]
+    response = client.post('/ai/moves', json={'boards': [VALID_INITIAL_STATE, unreachable_board]})
+    assert response.status_code == 400
+    assert is_status_4xx(client.post('/ai/moves', json={'boards': [[['foo']]]}))
+    assert is_status_4xx(client.post('/ai/moves', json={'boards': []}))
+
+
+def test_analyze():
+    print('Testing the analyze endpoint')
+    state = [['X', 'X', None], ['O', 'O', None], [None, None, None]]
+    response = client.post('/analyze', json={'state': state})
+    assert is_status_200(response)
+    assert response.json() == {
+        'player': 'X',
+        'moves': [
+            {'x': 0, 'y': 2, 'value': 1, 'plies': 1},
+            {'x': 1, 'y': 2, 'value': 0, 'plies': 5},
+            {'x': 2, 'y': 0, 'value': -1, 'plies': 2},
+            {'x': 2, 'y': 1, 'value': -1, 'plies': 2},
+            {'x': 2, 'y': 2, 'value': -1, 'plies': 2},
+        ]
+    }
+
+    unreachable_state = [['O', None, None], [None, None, None], [None, None, None]]
+    assert client.post('/analyze', json={'state': unreachable_state}).status_code == 400
+
+
+def get_stored_state(game_id):
+    with TestingSessionLocal() as db:
+        return db.get(Game, game_id).state
+
+def test_game_cache_write_behind():
+    print('Testing game actions through the write-behind cache')
+    main.game_cache = GameCache(AsyncTestingSessionLocal, max_size=2, ttl=60, flush_interval=60)
+    try:
+        game_id = client.post('/games/', json={}).json()['id']
+        response = client.patch(f'/games/{game_id}', json={"x": 1, "y": 1})
+        assert is_status_200(response)
+        assert client.get(f'/games/{game_id}').json()['state'] == response.json()['state']
+        assert get_stored_state(game_id) == VALID_INITIAL_STATE
+
+        # Listing games writes pending moves first.
+        client.get('/games/')
+        assert get_stored_state(game_id) == response.json()['state']
+
+        # Evicting a game with pending moves writes them.
+        client.patch(f'/games/{game_id}')
+        for i in range(2):
+            client.post('/games/', json={})
+        assert game_id not in main.game_cache.entries
+        assert get_stored_state(game_id)[0][0] == 'O'
+        with TestingSessionLocal() as db:
+            assert db.query(Move).filter(Move.game_id == game_id).count() == 2
+
+        stale_game = asyncio.run(get_game_with_new_session(game_id))
+        client.patch(f'/games/{game_id}', json={"x": 2, "y": 2})
+        with pytest.raises(GameConflict):
+            asyncio.run(main.game_cache.put(stale_game))
+    finally:
+        main.game_cache = None
+
+def test_game_cache_reads_evicted_game_during_write():
+    print('Testing that a game evicted from the cache is still read from it until it is written')
+    game_cache = GameCache(AsyncTestingSessionLocal, max_size=1, ttl=60, flush_interval=60)
+    first_id, second_id = populate_games_db()[:2]
+
+    async def evict_during_write():
+        first_game = await get_game_with_new_session(first_id, game_cache)
+        first_game.state[1][1] = 'X'
+        await game_cache.put(first_game)
+        # Hold the lock, so the write of the evicted game can't finish yet.
+        async with game_cache.flush_lock:
+            loading = asyncio.create_task(get_game_with_new_session(second_id, game_cache))
+            await asyncio.sleep(0.1)
+            assert first_id not in game_cache.entries
+            cached_game = await get_game_with_new_session(first_id, game_cache)
+            assert cached_game.state[1][1] == 'X'
+            assert cached_game.version == first_game.version
+        await loading
+        assert first_id not in game_cache.evicted
+
+    asyncio.run(evict_during_write())
+    assert get_stored_state(first_id)[1][1] == 'X'
+
+
+def test_game_cache_write_conflict():
+    print('Testing that the cache never overwrites a newer version of a game')
+    game_cache = GameCache(AsyncTestingSessionLocal, max_size=2, ttl=60, flush_interval=60)
+    game_id = populate_games_db()[0]
+
+    async def write_stale_game():
+        game = await get_game_with_new_session(game_id, game_cache)
+        game.state[1][1] = 'X'
+        await game_cache.put(game)
+        with engine.begin() as connection:
+            connection.execute(text("UPDATE games SET version = version + 5 WHERE id = :id"), {'id': game_id})
+        assert await game_cache.flush() == {game_id}
+        assert game_id not in game_cache.entries
+
+        game = await get_game_with_new_session(game_id, game_cache)
+        game.state[1][1] = 'X'
+        await game_cache.put(game)
+        with engine.begin() as connection:
+            connection.execute(text("UPDATE games SET version = version + 1 WHERE id = :id"), {'id': game_id})
+        game.winner = 'X'
+        with pytest.raises(GameConflict):
+            await game_cache.put(game)
+
+    asyncio.run(write_stale_game())
+    assert get_stored_state(game_id) == VALID_INITIAL_STATE
+
+def test_game_cache_write_failure_is_isolated():
+    print('Testing that a game whose moves clash with logged ones does not block writing the others')
+    game_cache = GameCache(AsyncTestingSessionLocal, max_size=2, ttl=60, flush_interval=60)
+    first_id, second_id = populate_games_db()[:2]
+    with TestingSessionLocal() as db:
+        db.add(Move(game_id=first_id, round=1, ply=1, symbol='X', x=0, y=0))
+        db.commit()
+
+    async def write_games():
+        for game_id in (first_id, second_id):
+            game = await get_game_with_new_session(game_id, game_cache)
+            game.state[1][1] = 'X'
+            await game_cache.put(game, [Move(game_id=game_id, round=game.round, ply=1, symbol='X', x=1, y=1, created_at=utc_now())])
+        assert await game_cache.flush() == {first_id}
+        assert first_id not in game_cache.entries
+        assert not game_cache.entries[second_id].dirty
+        await game_cache.close()
+
+    asyncio.run(write_games())
+    assert get_stored_state(first_id) == VALID_INITIAL_STATE
+    assert get_stored_state(second_id)[1][1] == 'X'
+    with TestingSessionLocal() as db:
+        assert db.query(Move).filter(Move.game_id == second_id).count() == 1
+
+async def get_game_with_new_session(game_id, game_cache=None):
+    async with AsyncTestingSessionLocal() as db:
+        if game_cache:
+            return await game_cache.get(db, game_id)
+        return await get_game_or_404(db, game_id)
+
     
 GAME_SIMULATION = [
     {
@@ -425,7 +930,11 @@ GAME_SIMULATION = [
                 ]
             ],
             "winner": None,
-            "current_player": "O"
+            "current_player": "O",
+            "board_size": 3,
+            "win_length": 3,
+            "engine": "minimax",
+            "difficulty": "hard"
         }
         
     },
@@ -452,7 +961,11 @@ GAME_SIMULATION = [
                 ]
             ],
             "winner": None,
-            "current_player": "X"
+            "current_player": "X",
+            "board_size": 3,
+            "win_length": 3,
+            "engine": "minimax",
+            "difficulty": "hard"
         }
         
     },
@@ -479,7 +992,11 @@ GAME_SIMULATION = [
                 ]
             ],
             "winner": None,
-            "current_player": "O"
+            "current_player": "O",
+            "board_size": 3,
+            "win_length": 3,
+            "engine": "minimax",
+            "difficulty": "hard"
         }
         
     },
@@ -506,7 +1023,11 @@ GAME_SIMULATION = [
                 ]
             ],
             "winner": None,
-            "current_player": "X"
+            "current_player": "X",
+            "board_size": 3,
+            "win_length": 3,
+            "engine": "minimax",
+            "difficulty": "hard"
         }
         
     },
@@ -533,7 +1054,11 @@ GAME_SIMULATION = [
                 ]
             ],
             "winner": None,
-            "current_player": "O"
+            "current_player": "O",
+            "board_size": 3,
+            "win_length": 3,
+            "engine": "minimax",
+            "difficulty": "hard"
         }
         
     },
@@ -560,7 +1085,11 @@ GAME_SIMULATION = [
                 ]
             ],
             "winner": "O",
-            "current_player": "X"
+            "current_player": "X",
+            "board_size": 3,
+            "win_length": 3,
+            "engine": "minimax",
+            "difficulty": "hard"
         }
         
     },
@@ -572,4 +1101,62 @@ GAME_SIMULATION = [
         }
         
     },
-]
\ No newline at end of file
+]
+
+def test_metrics():
+    print('Testing the metrics endpoint')
+    game_id = populate_games_db()[0]
+    client.patch(f'/games/{game_id}', params={'ai_reply': True}, json={'x': 1, 'y': 1})
+    response = client.get('/metrics')
+    assert is_status_200(response)
+    assert response.headers['content-type'].startswith('text/plain')
+    body = response.text
+    assert 'http_request_duration_seconds_count{method="PATCH",route="/games/{game_id}"}' in body
+    assert 'http_requests_total{method="PATCH",route="/games/{game_id}",status="200"}' in body
+    assert 'http_requests_in_flight 1' in body
+
+
+def test_debug_profile(monkeypatch):
+    print('Testing the debug profiling header')
+    # 3x3 games don't search, so the profiled game is 4x4.
+    game_id = client.post('/games/', json={'board_size': 4, 'difficulty': 'medium'}).json()['id']
+    monkeypatch.setitem(main.DIFFICULTY_LEVELS, 'medium', (2, 2000, 0))
+    headers = {DEBUG_PROFILE_HEADER: '1'}
+
+    response = client.patch(f'/games/{game_id}', params={'ai_reply': True}, json={'x': 1, 'y': 1}, headers=headers)
+    assert is_status_200(response)
+    assert 'debug' not in response.json()
+
+    monkeypatch.setattr(main, 'DEBUG_PROFILING', True)
+    state = response.json()['state']
+    x, y = next((x, y) for x in range(4) for y in range(4) if state[x][y] is None)
+    response = client.patch(f'/games/{game_id}', params={'ai_reply': True}, json={'x': x, 'y': y}, headers=headers)
+    assert is_status_200(response)
+    assert response.json()['state'][x][y] == 'X'
+    debug = response.json()['debug']
+    assert [search['function'] for search in debug['searches']] == ['tictactoe.best_move']
+    assert debug['searches'][0]['nodes'] > 0
+    assert 'function calls' in debug['profile']
+
+
+def test_search_best_move_coalesces_symmetric_boards(monkeypatch):
+    print('Testing that concurrent searches of equivalent boards share one search')
+    searched = []
+
+    async def run_search(function, *args):
+        searched.append(args[0])
+        await asyncio.sleep(0.1)
+        return function(*args)
+
+    monkeypatch.setattr(main.workers, 'run_search', run_search)
+    board = ttt.initial_state(4)
+    board[0][0], board[0][1], board[1][0], board[1][1] = 'X', 'X', 'O', 'O'
+    mirrored = [row[::-1] for row in board]
+
+    async def search_both():
+        return await asyncio.gather(
+            main.search_best_move(board, 3, None), main.search_best_move(mirrored, 3, None)
+        )
+
+    assert asyncio.run(search_both()) == [(0, 2), (0, 1)]
+    assert len(searched) == 1
@@ -0,0 +1,64 @@
+import tictactoe as ttt
+import mcts
+
+
+def best_move(board, win_length, iterations=3000):
+    return mcts.pick_move([mcts.search(board, win_length, iterations=iterations, time_budget=10, seed=1)], len(board))
+
+
+def test_mcts_takes_a_win():
+    board = ttt.initial_state(4)
+    board[0][0], board[0][1] = 'X', 'X'
+    board[1][0], board[1][1] = 'O', 'O'
+    assert best_move(board, 3) == (0, 2)
+
+
+def test_mcts_blocks_a_win():
+    board = ttt.initial_state(4)
+    board[0][3], board[3][3] = 'X', 'X'
+    board[1][0], board[1][1] = 'O', 'O'
+    assert best_move(board, 3) == (1, 2)
+
+
+def test_mcts_on_terminal_board():
+    board = [['X', 'X', 'X'], ['O', 'O', None], [None, None, None]]
+    assert best_move(board, 3) is None
+
+
+def test_pick_move_adds_up_trees():
+    assert mcts.pick_move([{0: (10, 5.0), 4: (8, 6.0)}, {4: (5, 2.0)}], 3) == (1, 1)
+    assert mcts.pick_move([{0: (4, 2.0), 4: (4, 3.0)}], 3) == (1, 1)
+    assert mcts.pick_move([], 3) is None
+
+
+def test_mcts_tree_reuse():
+    board = ttt.initial_state(5)
+    mcts.search(board, 4, iterations=500, time_budget=10, tree_key='test')
+    root = mcts.trees['test'][2]
+    assert root.visits == 500
+
+    # Pick a line the tree has explored: its move and the most visited reply.
+    move = max(root.children, key=lambda child: child.visits)
+    reply = max(move.children, key=lambda child: child.visits)
+    reply_visits = reply.visits
+    board = ttt.from_bitboard(move.mover_bits, reply.mover_bits, 5)
+    result = mcts.search(board, 4, iterations=100, time_budget=10, tree_key='test')
+    # The first visit of a node is its own rollout, the rest went to children.
+    assert sum(visits for visits, _ in result.values()) == reply_visits - 1 + 100
+    assert mcts.trees['test'][2] is reply and reply.parent is None
+
+    other_board = ttt.initial_state(5)
+    other_board[0][0] = 'X'
+    result = mcts.search(other_board, 4, iterations=100, time_budget=10, tree_key='test')
+    assert sum(visits for visits, _ in result.values()) == 100
+
+
+def test_mcts_tree_reuse_checks_geometry():
+    board = ttt.initial_state(5)
+    mcts.search(board, 4, iterations=200, time_budget=10, tree_key='geometry')
+    # The empty board has the same bits for any size and win length.
+    result = mcts.search(board, 3, iterations=50, time_budget=10, tree_key='geometry')
+    assert sum(visits for visits, _ in result.values()) == 50
+    result = mcts.search(ttt.initial_state(3), 3, iterations=50, time_budget=10, tree_key='geometry')
+    assert sum(visits for visits, _ in result.values()) == 50
+    assert all(cell < 9 for cell in result)
@@ -0,0 +1,51 @@
+from threading import Thread
+from sqlalchemy import create_engine, text
+import metrics
+
+
+def test_histogram_render():
+    histogram = metrics.Histogram('test_seconds', 'Test', (0.1, 1), ('route',))
+    metrics.REGISTRY.remove(histogram)
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, '/games/')
+    assert histogram.render() == [
+        '# HELP test_seconds Test',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{route="/games/",le="0.1"} 1',
+        'test_seconds_bucket{route="/games/",le="1"} 2',
+        'test_seconds_bucket{route="/games/",le="+Inf"} 3',
+        'test_seconds_sum{route="/games/"} 5.55',
+        'test_seconds_count{route="/games/"} 3',
+    ]
+
+
+def test_counter_adds_up_threads():
+    counter = metrics.Counter('test_total', 'Test', ('name',))
+    metrics.REGISTRY.remove(counter)
+
+    def count():
+        for _ in range(1000):
+            counter.inc('a"b')
+
+    threads = [Thread(target=count) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(counter.shards) == 4
+    assert counter.render()[-1] == 'test_total{name="a\\"b"} 4000'
+
+
+def test_instrument_engine():
+    engine = create_engine('sqlite://')
+    metrics.instrument_engine(engine)
+    before = metrics.DB_QUERY_DURATION.collect().get(('SELECT',), [0] * 20)
+    with engine.connect() as connection:
+        connection.execute(text('SELECT 1'))
+        try:
+            connection.execute(text('SELECT * FROM missing'))
+        except Exception:
+            pass
+    after = metrics.DB_QUERY_DURATION.collect()[('SELECT',)]
+    assert sum(after[:-1]) == sum(before[:-1]) + 1
+    assert metrics.DB_QUERY_ERRORS.collect()[('SELECT',)][0] >= 1
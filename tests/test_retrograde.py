@@ -0,0 +1,23 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+import retrograde
+import tictactoe as ttt
+
+REACHABLE_POSITIONS_NUMBER = 5478
+
+
+def test_retrograde_solution_matches_minimax():
+    solution = retrograde.solve()
+    assert solution.legal.sum() == REACHABLE_POSITIONS_NUMBER
+    assert retrograde.verify(solution) == []
+
+
+def test_board_index_round_trip():
+    board = [['X', None, 'O'], [None, 'X', None], ['O', None, None]]
+    index = retrograde.board_index(board)
+    assert retrograde.index_to_board(index) == board
+
+    solution = retrograde.solve()
+    assert solution.values[retrograde.board_index(ttt.initial_state())] == 0
+    assert ttt.CELLS[solution.best_moves[index]] == ttt.minimax(board)
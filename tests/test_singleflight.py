@@ -0,0 +1,85 @@
+import asyncio
+import time
+from threading import Thread
+import pytest
+from singleflight import SingleFlight
+
+
+def test_threads_share_one_call():
+    flights = SingleFlight()
+    calls, results = [], []
+
+    def compute(value):
+        calls.append(value)
+        time.sleep(0.2)
+        return value * 2
+
+    threads = [Thread(target=lambda: results.append(flights.call('key', compute, 21))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == [21]
+    assert results == [42] * 5
+    assert flights.calls == {}
+
+
+def test_coroutines_and_threads_share_one_call():
+    flights = SingleFlight()
+    shared = []
+    flights.on_shared = lambda: shared.append(1)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.2)
+        return 'move'
+
+    async def main():
+        leader = asyncio.create_task(flights.run('key', compute))
+        await asyncio.sleep(0.05)
+        thread_results = []
+        thread = Thread(target=lambda: thread_results.append(flights.call('key', lambda: 'other')))
+        thread.start()
+        results = await asyncio.gather(leader, *(flights.run('key', compute) for _ in range(3)))
+        await asyncio.to_thread(thread.join)
+        return results + thread_results
+
+    assert asyncio.run(main()) == ['move'] * 5
+    assert len(calls) == 1
+    assert len(shared) == 4
+
+
+def test_errors_are_shared():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.1)
+        raise TimeoutError
+
+    async def main():
+        return await asyncio.gather(*(flights.run('key', fail) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, TimeoutError) for result in asyncio.run(main()))
+    with pytest.raises(ZeroDivisionError):
+        flights.call('key', lambda: 1 / 0)
+
+
+def test_waiters_recompute_when_leader_is_cancelled():
+    flights = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return len(calls)
+
+    async def main():
+        leader = asyncio.create_task(flights.run('key', compute))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(flights.run('key', compute))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await waiter
+
+    assert asyncio.run(main()) == 2
@@ -0,0 +1,164 @@
+import time
+import tictactoe as ttt
+
+SOLVED_GAME = ttt.solve_game()
+REACHABLE_POSITIONS_NUMBER = 5478
+
+
+def key_to_board(key):
+    return ttt.from_bitboard(*key)
+
+
+def test_solved_game_covers_reachable_positions():
+    assert len(SOLVED_GAME) == REACHABLE_POSITIONS_NUMBER
+    assert SOLVED_GAME[ttt.board_key(ttt.initial_state())] == (0, [
+        (0, 0), (0, 1), (0, 2), (1, 0), (1, 1), (1, 2), (2, 0), (2, 1), (2, 2)
+    ])
+
+
+def test_solved_game_matches_minimax():
+    for key, (value, optimal_actions) in SOLVED_GAME.items():
+        if key == (0, 0):
+            continue
+        board = key_to_board(key)
+        if ttt.terminal(board):
+            assert optimal_actions == []
+            assert value == ttt.utility(board)
+            continue
+        assert optimal_actions[0] == ttt.minimax(board)
+
+
+def test_bitboard_adapters():
+    board = [['X', None, 'O'], [None, 'X', None], ['O', None, None]]
+    x_bits, o_bits = ttt.to_bitboard(board)
+    assert (x_bits, o_bits) == (0b000010001, 0b001000100)
+    assert ttt.from_bitboard(x_bits, o_bits) == board
+    assert ttt.player(board) == 'X'
+    assert ttt.actions(board) == [(0, 1), (1, 0), (1, 2), (2, 1), (2, 2)]
+    assert ttt.result(board, (2, 2))[2] == ['O', None, 'X']
+    assert ttt.winner(ttt.result(board, (2, 2))) == 'X'
+    assert board[2] == ['O', None, None]
+
+
+def test_symmetries_preserve_win_masks():
+    for transform in ttt.SYMMETRY_TRANSFORMS:
+        assert sorted(transform[mask] for mask in ttt.WIN_MASKS) == sorted(ttt.WIN_MASKS)
+
+    board = [['X', 'O', None], [None, 'X', None], [None, None, None]]
+    rotated = [[None, None, 'X'], [None, 'X', 'O'], [None, None, None]]
+    assert ttt.canonical_key(*ttt.to_bitboard(board)) == ttt.canonical_key(*ttt.to_bitboard(rotated))
+
+
+def test_minimax_with_small_transposition_table():
+    original_table = ttt.TRANSPOSITION_TABLE
+    ttt.TRANSPOSITION_TABLE = ttt.TranspositionTable(16)
+    try:
+        for key, (value, optimal_actions) in SOLVED_GAME.items():
+            if optimal_actions and key != (0, 0):
+                assert optimal_actions[0] == ttt.minimax(key_to_board(key))
+        assert len(ttt.TRANSPOSITION_TABLE) <= 16
+    finally:
+        ttt.TRANSPOSITION_TABLE = original_table
+
+
+def test_analyze_matches_solved_game():
+    for key, (value, optimal_actions) in SOLVED_GAME.items():
+        board = key_to_board(key)
+        analysis = ttt.analyze(board)
+        assert [action for action, _, _ in analysis] == (ttt.actions(board) if optimal_actions else [])
+        if not analysis:
+            continue
+
+        sign = 1 if ttt.player(board) == 'X' else -1
+        best_value = max(move_value for _, move_value, _ in analysis)
+        assert best_value == sign * value
+        assert [action for action, move_value, _ in analysis if move_value == best_value] == optimal_actions
+        assert all(1 <= plies <= len(analysis) for _, _, plies in analysis)
+
+
+def test_horizon_moves_match_depth_limited_search():
+    for key in list(SOLVED_GAME)[::10]:
+        board = key_to_board(key)
+        if ttt.terminal(board):
+            assert ttt.horizon_moves(board, 1) == []
+            continue
+        for max_depth in (1, 2):
+            assert ttt.best_move(board, 3, 10, max_depth) in ttt.horizon_moves(board, max_depth)
+    # Two plies deep, the threat on the bottom row is seen, one ply deep it isn't.
+    board = [[None, None, None], [None, 'O', None], [None, 'X', 'X']]
+    assert ttt.horizon_moves(board, 2) == [(2, 0)]
+    assert len(ttt.horizon_moves(board, 1)) == 6
+
+
+def test_best_move_matches_minimax_on_3x3():
+    for key, (value, optimal_actions) in SOLVED_GAME.items():
+        if optimal_actions and key != (0, 0):
+            board = key_to_board(key)
+            assert ttt.best_move(board) == ttt.minimax(board)
+
+
+def test_winner_with_win_length():
+    board = ttt.initial_state(5)
+    board[1][1] = board[2][2] = board[3][3] = 'X'
+    assert ttt.winner(board) is None
+    assert ttt.winner(board, 3) == 'X'
+    assert ttt.terminal(board, 3)
+    assert ttt.utility(board, 3) == 1
+
+
+def test_best_move_on_bigger_board():
+    board = ttt.initial_state(4)
+    board[0][0], board[0][1] = 'X', 'X'
+    board[1][0], board[1][1] = 'O', 'O'
+    # X completes three in a row instead of blocking O.
+    assert ttt.best_move(board, 3) == (0, 2)
+
+    board[0][0], board[0][1] = None, None
+    board[0][3], board[3][3] = 'X', 'X'
+    # X has nothing to win with, so it blocks O.
+    assert ttt.best_move(board, 3) == (1, 2)
+
+
+def test_best_move_respects_time_budget():
+    board = ttt.initial_state(7)
+    board[3][3] = 'X'
+    start = time.perf_counter()
+    action = ttt.best_move(board, 5, time_budget=0.2)
+    assert time.perf_counter() - start < 1
+    assert action in ttt.actions(board)
+
+
+def test_best_move_with_max_depth():
+    board = [['X', 'X', None], ['O', None, None], ['O', None, None]]
+    assert ttt.best_move(board, max_depth=1) == (0, 2)
+    board = [['X', None, None], [None, 'X', None], ['O', None, None]]
+    assert ttt.best_move(board, max_depth=2) == (2, 2)
+
+
+def test_search_stats():
+    board = [['X', None, None], [None, None, None], [None, None, None]]
+    ttt.TRANSPOSITION_TABLE.clear()
+    traced = []
+    stats = ttt.SearchStats(trace=lambda own_bits, opponent_bits, ply: traced.append(ply))
+    ttt.minimax(board, stats)
+    assert stats.nodes == len(traced) > 0
+    assert stats.max_depth == max(traced) <= 8
+    assert stats.cache_hits > 0
+    assert stats.elapsed > 0
+
+    stats = ttt.SearchStats()
+    ttt.best_move(ttt.initial_state(4), 3, time_budget=0.1, stats=stats)
+    assert stats.nodes > 0 and stats.max_depth > 0
+
+
+def test_canonical_form():
+    board = ttt.initial_state(4)
+    board[0][1], board[2][3] = 'X', 'O'
+    canonical_board, cells = ttt.canonical_form(board)
+    for permutation in ttt.board_symmetries(4):
+        flat = [element for row in board for element in row]
+        transformed = [[flat[permutation[i * 4 + j]] for j in range(4)] for i in range(4)]
+        assert ttt.canonical_form(transformed)[0] == canonical_board
+
+    flat = [element for row in canonical_board for element in row]
+    assert all(flat[cell] == board[source // 4][source % 4] for cell, source in enumerate(cells))
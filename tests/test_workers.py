@@ -0,0 +1,92 @@
+import asyncio
+import time
+import pytest
+import tictactoe as ttt
+import workers
+import metrics
+import mcts
+
+BOARD = [['X', None, None], [None, 'O', None], [None, None, 'X']]
+
+
+def test_run_search_in_process_pool():
+    try:
+        move = asyncio.run(workers.run_search(ttt.minimax, BOARD))
+        assert move == ttt.minimax(BOARD)
+        assert ('tictactoe.minimax',) in metrics.AI_SEARCH_NODES.collect()
+
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(workers.run_search(time.sleep, 1, timeout=0.1))
+    finally:
+        workers.shutdown_executor()
+
+
+def test_timeout_frees_the_workers():
+    # More long searches than workers: the running ones stop at the deadline
+    # and the queued one is skipped, so the pool is free right afterwards.
+    board = ttt.initial_state(7)
+
+    async def time_out_searches():
+        searches = [workers.run_search(mcts.search, board, 4, 10 ** 9, 30, timeout=0.3)
+                    for _ in range(workers.AI_WORKERS + 1)]
+        return await asyncio.gather(*searches, return_exceptions=True)
+
+    try:
+        workers.start_executor()
+        results = asyncio.run(time_out_searches())
+        assert all(isinstance(result, asyncio.TimeoutError) for result in results)
+        start = time.perf_counter()
+        assert asyncio.run(workers.run_search(ttt.minimax, BOARD, timeout=2)) == ttt.minimax(BOARD)
+        assert time.perf_counter() - start < 1
+    finally:
+        workers.shutdown_executor()
+
+
+def test_run_searches_in_process_pool():
+    board = ttt.initial_state(4)
+    board[0][0], board[0][1] = 'X', 'X'
+    board[1][0], board[1][1] = 'O', 'O'
+    try:
+        results = asyncio.run(workers.run_searches(mcts.search, [(board, 3, 2000, 5, None, seed) for seed in range(2)]))
+        assert len(results) == 2
+        assert mcts.pick_move(results, 4) == (0, 2)
+    finally:
+        workers.shutdown_executor()
+
+
+def test_mcts_trees_reused_by_their_workers():
+    # Every tree goes back to the worker that grew it, so each search of the
+    # second move starts from its subtree with the visits it already has.
+    board = ttt.initial_state(4)
+    board[1][1], board[2][2] = 'X', 'O'
+    searches = lambda board: [(board, 3, 2000, 5, ('game', 0, tree)) for tree in range(workers.AI_WORKERS)]
+    try:
+        results = asyncio.run(workers.run_searches(mcts.search, searches(board)))
+        assert all(sum(visits for visits, _ in result.values()) == 2000 for result in results)
+        board = ttt.result(board, mcts.pick_move(results, 4))
+        board = ttt.result(board, next(action for action in [(1, 2), (2, 1)] if action in ttt.actions(board)))
+        results = asyncio.run(workers.run_searches(mcts.search, searches(board)))
+        assert len(results) == workers.AI_WORKERS > 1
+        assert all(sum(visits for visits, _ in result.values()) > 2000 for result in results)
+    finally:
+        workers.shutdown_executor()
+
+
+traced = []
+
+def record_trace(own_bits, opponent_bits, ply):
+    traced.append(ply)
+
+def traced_search(board):
+    traced.clear()
+    ttt.minimax(board)
+    return len(traced)
+
+
+def test_trace_hook_installed_in_workers(monkeypatch):
+    workers.shutdown_executor()
+    monkeypatch.setattr(workers, 'SEARCH_TRACE_HOOK', f'{__name__}:record_trace')
+    try:
+        assert asyncio.run(workers.run_search(traced_search, BOARD)) > 0
+    finally:
+        workers.shutdown_executor()
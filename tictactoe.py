@@ -1,134 +1,639 @@
-from copy import deepcopy
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import product
+from threading import Lock
+import time
+from config import *
 
 X = "X"
 O = "O"
 EMPTY = None
 
+# Boards are searched as two 9-bit integers, one per player. Cell (i, j) is
+# bit i * 3 + j, so bit order matches the order of actions().
+CELLS = tuple(divmod(cell, 3) for cell in range(9))
+CELL_BITS = tuple(1 << cell for cell in range(9))
+FULL_BOARD = 0b111111111
+WIN_MASKS = (
+    0b000000111, 0b000111000, 0b111000000,
+    0b001001001, 0b010010010, 0b100100100,
+    0b100010001, 0b001010100,
+)
+# Lookup tables indexed by a 9-bit mask, so the search never loops over cells.
+IS_WIN = tuple(
+    any(bits & mask == mask for mask in WIN_MASKS) for bits in range(FULL_BOARD + 1)
+)
+FREE_CELLS = tuple(
+    tuple(cell for cell in range(9) if not occupied & CELL_BITS[cell])
+    for occupied in range(FULL_BOARD + 1)
+)
 
-def initial_state():
+# Center first, then corners, then edges: strong moves first make alpha-beta
+# cut off sooner.
+MOVE_ORDER = (4, 0, 2, 6, 8, 1, 3, 5, 7)
+ORDERED_FREE_CELLS = tuple(
+    tuple(cell for cell in MOVE_ORDER if not occupied & CELL_BITS[cell])
+    for occupied in range(FULL_BOARD + 1)
+)
 
-    return [[EMPTY, EMPTY, EMPTY],
-            [EMPTY, EMPTY, EMPTY],
-            [EMPTY, EMPTY, EMPTY]]
 
+def transform_cells(cells, bits):
+    return sum(CELL_BITS[cells[cell]] for cell in range(9) if bits & CELL_BITS[cell])
 
-def player(board):
-    X, O = 0, 0
-    for row in board:
-        for element in row:
-            if element == 'X':
-                X += 1
-            elif element == 'O':
-                O += 1
-    if X <= O or (X == 0 and O == 0):
-        return 'X'
-    else:
-        return 'O'
 
+# SYMMETRY_TRANSFORMS[n][bits] maps a 9-bit mask through one of the board's 8
+# rotations and reflections.
+SYMMETRIES = (
+    (0, 1, 2, 3, 4, 5, 6, 7, 8),
+    (2, 5, 8, 1, 4, 7, 0, 3, 6),
+    (8, 7, 6, 5, 4, 3, 2, 1, 0),
+    (6, 3, 0, 7, 4, 1, 8, 5, 2),
+    (2, 1, 0, 5, 4, 3, 8, 7, 6),
+    (6, 7, 8, 3, 4, 5, 0, 1, 2),
+    (0, 3, 6, 1, 4, 7, 2, 5, 8),
+    (8, 5, 2, 7, 4, 1, 6, 3, 0),
+)
+SYMMETRY_TRANSFORMS = tuple(
+    tuple(transform_cells(cells, bits) for bits in range(FULL_BOARD + 1)) for cells in SYMMETRIES
+)
 
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
 
-def actions(board):
-    actions = []
+WIN_SCORE = 10 ** 9
+INFINITE_SCORE = 10 ** 10
+LINE_SCORES = tuple(10 ** count for count in range(32))
+
+# Positions searched by this process so far, for metrics.
+nodes_searched = 0
+# Wall-clock time (time.time(), which means the same in every process) the
+# task an AI worker is running has to be done by. Searches with a time budget
+# stop then even if their budget isn't used up, so a search that timed out
+# doesn't keep holding its worker.
+task_deadline = None
+# If set, called with (own_bits, opponent_bits, ply) for every position any
+# search visits, e.g. to log search trees. A single search can get its own with
+# SearchStats(trace=...).
+trace_hook = None
+
+
+class SearchStats:
+    # What a search did. Pass one to minimax(), best_move() or mcts.search()
+    # to have it filled in; passing the same one to several searches adds
+    # them up.
+
+    def __init__(self, trace=None):
+        self.nodes = 0
+        self.cache_hits = 0
+        self.max_depth = 0
+        self.elapsed = 0.0
+        self.trace = trace or trace_hook
+
+    def as_dict(self):
+        return {
+            'nodes': self.nodes,
+            'cache_hits': self.cache_hits,
+            'max_depth': self.max_depth,
+            'elapsed': self.elapsed,
+        }
+
+
+@contextmanager
+def recording(stats):
+    global nodes_searched
+    start, start_nodes = time.perf_counter(), stats.nodes
+    try:
+        yield
+    finally:
+        stats.elapsed += time.perf_counter() - start
+        nodes_searched += stats.nodes - start_nodes
+
+
+def initial_state(size=3):
+
+    return [[EMPTY] * size for _ in range(size)]
+
+
+def to_bitboard(board):
+    size = len(board)
+    x_bits, o_bits = 0, 0
     for i, row in enumerate(board):
         for j, element in enumerate(row):
-            if not element:
-                actions.append((i, j))
-    return actions
+            if element == X:
+                x_bits |= 1 << (i * size + j)
+            elif element == O:
+                o_bits |= 1 << (i * size + j)
+    return x_bits, o_bits
+
+
+def from_bitboard(x_bits, o_bits, size=3):
+    board = initial_state(size)
+    for cell in range(size * size):
+        i, j = divmod(cell, size)
+        if x_bits >> cell & 1:
+            board[i][j] = X
+        elif o_bits >> cell & 1:
+            board[i][j] = O
+    return board
+
+
+def bitboard_player(x_bits, o_bits):
+    if x_bits.bit_count() <= o_bits.bit_count():
+        return X
+    return O
+
+
+def bitboard_winner(x_bits, o_bits):
+    if IS_WIN[x_bits]:
+        return X
+    if IS_WIN[o_bits]:
+        return O
+    return None
+
+
+def bitboard_terminal(x_bits, o_bits):
+    return IS_WIN[x_bits] or IS_WIN[o_bits] or x_bits | o_bits == FULL_BOARD
+
+
+def bitboard_utility(x_bits, o_bits):
+    if IS_WIN[x_bits]:
+        return 1
+    if IS_WIN[o_bits]:
+        return -1
+    return 0
+
+
+def player(board):
+    return bitboard_player(*to_bitboard(board))
+
+
+def actions(board):
+    size = len(board)
+    x_bits, o_bits = to_bitboard(board)
+    occupied = x_bits | o_bits
+    return [divmod(cell, size) for cell in range(size * size) if not occupied >> cell & 1]
 
 
 def result(board, action):
     i, j = action[0], action[1]
     if board[i][j]:
         raise Exception("Action isn't valid")
-    board = deepcopy(board)
-    board[i][j] = player(board)
-    return board
-
-def check_sequence_winner(sequence):
-    if sequence == ['X', 'X', 'X']:
-        return 'X'
-    elif sequence == ['O', 'O', 'O']:
-        return 'O'
-    return None
+    size = len(board)
+    x_bits, o_bits = to_bitboard(board)
+    if bitboard_player(x_bits, o_bits) == X:
+        x_bits |= 1 << (i * size + j)
+    else:
+        o_bits |= 1 << (i * size + j)
+    return from_bitboard(x_bits, o_bits, size)
 
-def winner(board):
-    for i in range(3):
-        row_winner = check_sequence_winner(board[i])
-        if row_winner:
-            return row_winner
-
-        column_winner = check_sequence_winner([board[j][i] for j in range(3)])
-        if column_winner:
-            return column_winner
-
-    diagonals = [
-        [board[i][i] for i in range(3)],
-        [board[i][2 - i] for i in range(3)]
-    ]
-    for diag in diagonals:
-        diag_winner = check_sequence_winner(diag)
-        if diag_winner:
-            return diag_winner
 
+# Boards can be any size from 3x3 up, and win_length (k in a row) defaults to
+# the board size.
+def winner(board, win_length=None):
+    x_bits, o_bits = to_bitboard(board)
+    masks = win_masks(len(board), win_length or len(board))
+    if any(x_bits & mask == mask for mask in masks):
+        return X
+    if any(o_bits & mask == mask for mask in masks):
+        return O
     return None
 
 
-print(winner(initial_state()))
-
-def terminal(board):
-    if winner(board):
+def terminal(board, win_length=None):
+    if winner(board, win_length):
         return True
-    for row in board:
-        for element in row:
-            if not element:
-                return False
-    return True
+    x_bits, o_bits = to_bitboard(board)
+    return x_bits | o_bits == (1 << len(board) ** 2) - 1
 
 
-def utility(board):
+def utility(board, win_length=None):
 
-    game_winner = winner(board)
-    if game_winner == 'X':
+    game_winner = winner(board, win_length)
+    if game_winner == X:
         return 1
-    elif game_winner == 'O':
+    elif game_winner == O:
         return -1
     else:
         return 0
 
-def minimax(board):
+
+@lru_cache(maxsize=None)
+def win_masks(size, win_length):
+    masks = []
+    for i in range(size):
+        for j in range(size):
+            for di, dj in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                end_i, end_j = i + di * (win_length - 1), j + dj * (win_length - 1)
+                if 0 <= end_i < size and 0 <= end_j < size:
+                    masks.append(sum(1 << ((i + di * n) * size + j + dj * n) for n in range(win_length)))
+    return tuple(masks)
+
+
+@lru_cache(maxsize=None)
+def board_symmetries(size):
+    # The 8 rotations and reflections of a size x size board, as cell
+    # permutations: the transformed board has at cell c what the board has at
+    # cell permutation[c]. Any of them maps winning lines onto winning lines.
+    last = size - 1
+    permutations = []
+    for transpose, flip_rows, flip_columns in product((False, True), repeat=3):
+        permutation = []
+        for i in range(size):
+            for j in range(size):
+                row, column = (j, i) if transpose else (i, j)
+                if flip_rows:
+                    row = last - row
+                if flip_columns:
+                    column = last - column
+                permutation.append(row * size + column)
+        permutations.append(tuple(permutation))
+    return tuple(permutations)
+
+
+def canonical_form(board):
+    # Returns the same board for every position that is a rotation or
+    # reflection of this one, and the permutation that maps its cells back to
+    # this board's.
+    size = len(board)
+    cells = [element for row in board for element in row]
+    best_key, best_permutation = None, None
+    for permutation in board_symmetries(size):
+        x_bits = o_bits = 0
+        for cell, source in enumerate(permutation):
+            if cells[source] == X:
+                x_bits |= 1 << cell
+            elif cells[source] == O:
+                o_bits |= 1 << cell
+        if best_key is None or (x_bits, o_bits) < best_key:
+            best_key, best_permutation = (x_bits, o_bits), permutation
+    return from_bitboard(*best_key, size), best_permutation
+
+
+def best_move(board, win_length=None, time_budget=AI_MOVE_TIME_BUDGET, max_depth=None, stats=None):
+    # 3x3 is small enough to always search to the end, bigger boards get the
+    # best move BoundedSearch finds within time_budget seconds. max_depth
+    # limits how many plies ahead it looks, for weaker opponents.
+    size = len(board)
+    win_length = win_length or size
+    if size == 3 and max_depth is None:
+        return minimax(board, stats)
+    if terminal(board, win_length):
+        return
+
+    own_bits, opponent_bits = to_bitboard(board)
+    if bitboard_player(own_bits, opponent_bits) == O:
+        own_bits, opponent_bits = opponent_bits, own_bits
+    stats = stats or SearchStats()
+    search = BoundedSearch(size, win_length, search_deadline(time_budget), stats)
+    with recording(stats):
+        return divmod(search.run(own_bits, opponent_bits, max_depth), size)
+
+
+def search_deadline(time_budget):
+    # The monotonic time a search given time_budget seconds has to stop at.
+    now = time.monotonic()
+    deadline = now + time_budget
+    if task_deadline is not None:
+        deadline = min(deadline, now + task_deadline - time.time())
+    return deadline
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class BoundedSearch:
+    # Iterative deepening negamax with alpha-beta for boards that can't be
+    # searched to the end. Every iteration goes one ply deeper, trying the last
+    # iteration's best move first, and positions at the depth limit are scored
+    # by evaluate(). When the deadline passes, the best move of the last
+    # finished iteration is played.
+
+    def __init__(self, size, win_length, deadline, stats=None):
+        self.size = size
+        self.win_length = win_length
+        self.masks = win_masks(size, win_length)
+        self.masks_by_cell = masks_by_cell(size, win_length)
+        self.full_board = (1 << size * size) - 1
+        self.deadline = deadline
+        self.stats = stats or SearchStats()
+        self.depth = 0
+
+    def run(self, own_bits, opponent_bits, max_depth=None):
+        moves = self.candidate_moves(own_bits | opponent_bits)
+        best_cell = moves[0]
+        free_cells = self.size * self.size - (own_bits | opponent_bits).bit_count()
+        for depth in range(1, min(free_cells, max_depth or free_cells) + 1):
+            moves = [best_cell] + [cell for cell in moves if cell != best_cell]
+            try:
+                value, best_cell = self.search_root(own_bits, opponent_bits, depth, moves)
+            except SearchTimeout:
+                break
+            if abs(value) >= WIN_SCORE:
+                break
+        return best_cell
+
+    def search_root(self, own_bits, opponent_bits, depth, moves):
+        self.depth = depth
+        alpha, best_cell = -INFINITE_SCORE, moves[0]
+        for cell in moves:
+            value = -self.negamax(opponent_bits, own_bits | 1 << cell, cell, depth - 1, -INFINITE_SCORE, -alpha)
+            if value > alpha:
+                alpha, best_cell = value, cell
+        return alpha, best_cell
+
+    def negamax(self, own_bits, opponent_bits, last_cell, depth, alpha, beta):
+        stats = self.stats
+        stats.nodes += 1
+        if not stats.nodes & 255 and time.monotonic() > self.deadline:
+            raise SearchTimeout
+        ply = self.depth - depth
+        if ply > stats.max_depth:
+            stats.max_depth = ply
+        if stats.trace:
+            stats.trace(own_bits, opponent_bits, ply)
+
+        for mask in self.masks_by_cell[last_cell]:
+            if opponent_bits & mask == mask:
+                # Losing sooner is worse, so a loss with more depth left scores lower.
+                return -(WIN_SCORE + depth)
+        occupied = own_bits | opponent_bits
+        if occupied == self.full_board:
+            return 0
+        if depth == 0:
+            return self.evaluate(own_bits, opponent_bits)
+
+        for cell in self.candidate_moves(occupied):
+            value = -self.negamax(opponent_bits, own_bits | 1 << cell, cell, depth - 1, -beta, -alpha)
+            if value > alpha:
+                alpha = value
+                if alpha >= beta:
+                    break
+        return alpha
+
+    def evaluate(self, own_bits, opponent_bits):
+        # Every line that can still be won counts for the only player with
+        # symbols on it, more the closer it is to complete.
+        score = 0
+        for mask in self.masks:
+            own_line, opponent_line = own_bits & mask, opponent_bits & mask
+            if own_line and not opponent_line:
+                score += LINE_SCORES[own_line.bit_count()]
+            elif opponent_line and not own_line:
+                score -= LINE_SCORES[opponent_line.bit_count()]
+        return score
+
+    def candidate_moves(self, occupied):
+        return candidate_cells(occupied, self.size)
+
+
+def candidate_cells(occupied, size):
+    # On a big board only cells next to a symbol are worth trying. Cells come
+    # center first.
+    order = cell_order(size)
+    if not occupied:
+        return list(order)
+    neighbours = neighbour_masks(size)
+    nearby = 0
+    for cell in range(size * size):
+        if occupied >> cell & 1:
+            nearby |= neighbours[cell]
+    nearby &= ~occupied
+    return [cell for cell in order if nearby >> cell & 1]
+
+
+@lru_cache(maxsize=None)
+def masks_by_cell(size, win_length):
+    return tuple(
+        tuple(mask for mask in win_masks(size, win_length) if mask >> cell & 1) for cell in range(size * size)
+    )
+
+
+@lru_cache(maxsize=None)
+def neighbour_masks(size):
+    masks = []
+    for cell in range(size * size):
+        i, j = divmod(cell, size)
+        masks.append(sum(
+            1 << (n_i * size + n_j)
+            for n_i in range(max(i - 1, 0), min(i + 2, size))
+            for n_j in range(max(j - 1, 0), min(j + 2, size))
+            if (n_i, n_j) != (i, j)
+        ))
+    return tuple(masks)
+
+
+@lru_cache(maxsize=None)
+def cell_order(size):
+    # Cells closest to the center first, they take part in the most lines.
+    center = (size - 1) / 2
+    return tuple(sorted(
+        range(size * size),
+        key=lambda cell: (abs(cell // size - center) + abs(cell % size - center), cell)
+    ))
+
+
+def minimax(board, stats=None):
+    # Exhaustive search, 3x3 boards only.
 
     if terminal(board):
         return
     if board == initial_state():
         return (0, 0)
 
-    actual_player = player(board)
-    if actual_player == 'O':
-        return minimize(board)[1]
-    return maximize(board)[1]
+    own_bits, opponent_bits = to_bitboard(board)
+    if bitboard_player(own_bits, opponent_bits) == O:
+        own_bits, opponent_bits = opponent_bits, own_bits
 
-def minimize(board):
-    if terminal(board):
-        return (utility(board), 0)
+    # The root goes through moves in actions() order and only switches on a
+    # strictly better value, so ties are broken exactly like they always were.
+    # Searching with alpha at the best value so far means a move that isn't
+    # better comes back as an upper bound, which is all we need to reject it.
+    stats = stats or SearchStats()
+    best_value, best_cell = -2, None
+    with recording(stats):
+        for cell in FREE_CELLS[own_bits | opponent_bits]:
+            value = -negamax(opponent_bits, own_bits | CELL_BITS[cell], -1, -best_value, stats)
+            if value > best_value:
+                best_value, best_cell = value, cell
+                if best_value == 1:
+                    break
+    return CELLS[best_cell]
+
+
+def negamax(own_bits, opponent_bits, alpha, beta, stats, ply=1):
+    # Value of the position for the player to move: 1 win, 0 draw, -1 loss.
+    stats.nodes += 1
+    if ply > stats.max_depth:
+        stats.max_depth = ply
+    if stats.trace:
+        stats.trace(own_bits, opponent_bits, ply)
+    if IS_WIN[opponent_bits]:
+        return -1
+    occupied = own_bits | opponent_bits
+    if occupied == FULL_BOARD:
+        return 0
+
+    key = canonical_key(own_bits, opponent_bits)
+    entry = TRANSPOSITION_TABLE.get(key)
+    if entry:
+        stats.cache_hits += 1
+        bound, value = entry
+        if bound == EXACT:
+            return value
+        if bound == LOWER_BOUND:
+            alpha = max(alpha, value)
+        else:
+            beta = min(beta, value)
+        if alpha >= beta:
+            return value
+
+    original_alpha = alpha
+    best_value = -2
+    for cell in ORDERED_FREE_CELLS[occupied]:
+        value = -negamax(opponent_bits, own_bits | CELL_BITS[cell], -beta, -alpha, stats, ply + 1)
+        if value > best_value:
+            best_value = value
+            if value > alpha:
+                alpha = value
+                if alpha >= beta:
+                    break
+
+    if best_value <= original_alpha:
+        TRANSPOSITION_TABLE.store(key, UPPER_BOUND, best_value)
+    elif best_value >= beta:
+        TRANSPOSITION_TABLE.store(key, LOWER_BOUND, best_value)
+    else:
+        TRANSPOSITION_TABLE.store(key, EXACT, best_value)
+    return best_value
 
-    min_value, min_action = float('inf'), 0
 
-    for action in actions(board):
-        action_result = maximize(result(board, action))
-        if action_result[0] < min_value:
-            min_value = action_result[0]
-            min_action = action
-    return (min_value, min_action)
+def canonical_key(own_bits, opponent_bits):
+    # The smallest encoding among the 8 rotations and reflections of the board.
+    return min(
+        transform[own_bits] | transform[opponent_bits] << 9 for transform in SYMMETRY_TRANSFORMS
+    )
 
-def maximize(board):
+
+class TranspositionTable:
+    # A bounded LRU map from canonical_key() to (bound, value), shared by every
+    # search in the process.
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                self.entries.move_to_end(key)
+            return entry
+
+    def store(self, key, bound, value):
+        with self.lock:
+            self.entries[key] = (bound, value)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+TRANSPOSITION_TABLE = TranspositionTable(TRANSPOSITION_TABLE_SIZE)
+
+
+def analyze(board):
+    # Every legal move in actions() order as (action, value, plies). The value
+    # is for the player making the move (1 win, 0 draw, -1 loss) and plies is
+    # how many moves, this one included, the game lasts after it when both
+    # players play perfectly.
     if terminal(board):
-        return (utility(board), 0)
-
-    max_value, max_action = float('-inf'), 0    
-    for action in actions(board):
-        action_result = minimize(result(board, action))
-        
-        if action_result[0] > max_value:
-            max_value = action_result[0]
-            max_action = action
-    return (max_value, max_action)
\ No newline at end of file
+        return []
+
+    own_bits, opponent_bits = to_bitboard(board)
+    if bitboard_player(own_bits, opponent_bits) == O:
+        own_bits, opponent_bits = opponent_bits, own_bits
+
+    analysis = []
+    for cell in FREE_CELLS[own_bits | opponent_bits]:
+        value, plies = exact_negamax(opponent_bits, own_bits | CELL_BITS[cell])
+        analysis.append((CELLS[cell], -value, plies + 1))
+    return analysis
+
+
+@lru_cache(maxsize=ANALYSIS_CACHE_SIZE)
+def exact_negamax(own_bits, opponent_bits):
+    # Like negamax(), but without pruning so the value is always exact, and
+    # together with the number of plies left: a winner takes the fastest win,
+    # a loser holds out as long as possible.
+    if IS_WIN[opponent_bits]:
+        return (-1, 0)
+    occupied = own_bits | opponent_bits
+    if occupied == FULL_BOARD:
+        return (0, 0)
+
+    best = None
+    for cell in FREE_CELLS[occupied]:
+        value, plies = exact_negamax(opponent_bits, own_bits | CELL_BITS[cell])
+        outcome = (-value, plies + 1)
+        if best is None or outcome_rank(outcome) > outcome_rank(best):
+            best = outcome
+    return best
+
+
+def outcome_rank(outcome):
+    value, plies = outcome
+    return (value, -plies if value > 0 else plies)
+
+
+def horizon_moves(board, max_depth):
+    # The moves a search max_depth plies deep would rate best, read from the
+    # exact analysis instead of searched: a result more than max_depth plies
+    # away is beyond the horizon and counts as a draw.
+    seen = [(action, value if plies <= max_depth else 0) for action, value, plies in analyze(board)]
+    if not seen:
+        return []
+    best = max(value for _, value in seen)
+    return [action for action, value in seen if value == best]
+
+
+def board_key(board):
+    return to_bitboard(board)
+
+
+def solve_game():
+    # Maps every reachable position, keyed by board_key(), to (value, optimal
+    # actions). Values are from X's point of view, like utility(), and optimal
+    # actions are kept in actions() order, so the first one is the move
+    # minimax() would pick.
+    table = {}
+
+    def solve(x_bits, o_bits):
+        key = (x_bits, o_bits)
+        if key in table:
+            return table[key][0]
+        if bitboard_terminal(x_bits, o_bits):
+            table[key] = (bitboard_utility(x_bits, o_bits), [])
+            return table[key][0]
+
+        values = []
+        if bitboard_player(x_bits, o_bits) == X:
+            for cell in FREE_CELLS[x_bits | o_bits]:
+                values.append((CELLS[cell], solve(x_bits | CELL_BITS[cell], o_bits)))
+            best_value = max(value for _, value in values)
+        else:
+            for cell in FREE_CELLS[x_bits | o_bits]:
+                values.append((CELLS[cell], solve(x_bits, o_bits | CELL_BITS[cell])))
+            best_value = min(value for _, value in values)
+        table[key] = (best_value, [action for action, value in values if value == best_value])
+        return best_value
+
+    solve(0, 0)
+    return table
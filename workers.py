@@ -0,0 +1,121 @@
+import asyncio
+import importlib
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+import tictactoe as ttt
+import metrics
+from config import *
+
+# One single-process pool per worker rather than one shared pool, so a task
+# can be sent to a given worker: an MCTS tree is only reused by the process
+# that grew it. running holds each worker's unfinished tasks.
+executors = []
+running = []
+
+
+def warm_up_worker(trace_hook=None):
+    # Fills the worker's transposition table before it gets its first real
+    # search.
+    ttt.minimax([[ttt.X, ttt.EMPTY, ttt.EMPTY],
+                 [ttt.EMPTY, ttt.EMPTY, ttt.EMPTY],
+                 [ttt.EMPTY, ttt.EMPTY, ttt.EMPTY]])
+    install_trace_hook(trace_hook)
+
+
+def install_trace_hook(path):
+    # Workers are spawned, so a ttt.trace_hook set in the API process never
+    # reaches them. Every process imports the hook from its path instead.
+    if not path:
+        return
+    module_name, _, function_name = path.partition(':')
+    ttt.trace_hook = getattr(importlib.import_module(module_name), function_name)
+
+
+def get_executors():
+    if not executors:
+        context = multiprocessing.get_context('spawn')
+        for _ in range(AI_WORKERS):
+            executors.append(ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=context,
+                initializer=warm_up_worker,
+                initargs=(SEARCH_TRACE_HOOK,),
+            ))
+            running.append([])
+    return executors
+
+
+def submit(worker, function, *args):
+    future = get_executors()[worker].submit(function, *args)
+    running[worker].append(future)
+    return asyncio.wrap_future(future)
+
+
+def least_busy_worker():
+    get_executors()
+    for futures in running:
+        futures[:] = [future for future in futures if not future.done()]
+    return min(range(AI_WORKERS), key=lambda worker: len(running[worker]))
+
+
+def start_executor():
+    install_trace_hook(SEARCH_TRACE_HOOK)
+    if AI_WORKERS == 0:
+        return
+    # A pool only starts its process when it has work waiting, so give every
+    # worker a task to have all of them up before the first move.
+    for future in [pool.submit(ttt.initial_state) for pool in get_executors()]:
+        future.result()
+
+
+def shutdown_executor():
+    for pool in executors:
+        pool.shutdown(wait=False, cancel_futures=True)
+    executors.clear()
+    running.clear()
+
+
+def measured(deadline, function, *args):
+    # Runs in the worker, so the time doesn't include waiting for it. Cancelling
+    # the caller's future doesn't reach the worker, so the worker itself skips
+    # a task whose caller has given up, and time-bounded searches stop by the
+    # deadline.
+    if time.time() > deadline:
+        return None, 0.0, 0
+    ttt.task_deadline = deadline
+    start, start_nodes = time.perf_counter(), ttt.nodes_searched
+    try:
+        result = function(*args)
+    finally:
+        ttt.task_deadline = None
+    return result, time.perf_counter() - start, ttt.nodes_searched - start_nodes
+
+
+async def run_search(function, *args, timeout=AI_SEARCH_TIMEOUT):
+    deadline = time.time() + timeout
+    if AI_WORKERS == 0:
+        result, elapsed, nodes = measured(deadline, function, *args)
+    else:
+        future = submit(least_busy_worker(), measured, deadline, function, *args)
+        result, elapsed, nodes = await asyncio.wait_for(future, timeout=timeout)
+    metrics.record_search(function, elapsed, nodes)
+    return result
+
+
+async def run_searches(function, args_list, timeout=AI_SEARCH_TIMEOUT):
+    # Runs the same search several times at once, call i on worker i (modulo
+    # the number of workers), so a search that keeps state in its process
+    # finds it there on the next call.
+    deadline = time.time() + timeout
+    if AI_WORKERS == 0:
+        searches = [measured(deadline, function, *args) for args in args_list]
+    else:
+        futures = [
+            submit(worker % AI_WORKERS, measured, deadline, function, *args)
+            for worker, args in enumerate(args_list)
+        ]
+        searches = await asyncio.wait_for(asyncio.gather(*futures), timeout=timeout)
+    for _, elapsed, nodes in searches:
+        metrics.record_search(function, elapsed, nodes)
+    return [result for result, _, _ in searches]